@@ -0,0 +1,565 @@
+#!/usr/bin/env python
+'''
+    send changes straight to a CalDAV calendar, instead of writing an update file
+    to import by hand.
+
+    a new event is PUT as a resource of the calendar collection named for its uid -
+    <calendar url><uid>.ics - with If-None-Match: *, so one already there isn't
+    overwritten. a changed or cancelled event is fetched for its ETag, from there,
+    or if it isn't there, from wherever a calendar-query REPORT finds its uid (a
+    server, or another client, may have named it otherwise). it's then PUT (or
+    DELETEd) with If-Match, so one changed in the calendar since it was read isn't
+    overwritten either. either is reported as a conflict and left be, as is a
+    change to an event that can't be found. a change to one instance of a
+    recurring event goes in its series' resource.
+
+    connections are kept open and reused, several at once. a request that fails on
+    a dropped connection, or is answered 429 or 5xx, is tried again after a pause -
+    but a PUT or DELETE that got as far as the server may have been made, so the
+    event is fetched again first, and if it was, it isn't sent again.
+
+    run as a program, this is a stand-in CalDAV server for trying it out:
+        ./caldav_push.py -p 8008 -l tuners2023.ics
+        ./perfcal.py --caldav http://localhost:8008/tuners/
+'''
+
+import os, sys
+sys.dont_write_bytecode = True
+import getopt
+import time
+import queue
+import base64
+import threading
+import http.client
+from hashlib import sha1
+from datetime import datetime
+from urllib.parse import urlsplit, quote
+from xml.sax.saxutils import escape
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from icalendar import Calendar
+import pytz
+
+import diag
+from event_map import by_start
+
+# requests sent at once
+WORKERS = 8
+# tries after the first, and the pause before the first of them (doubled each time)
+RETRIES = 3
+BACKOFF = 0.5
+# answers worth trying again
+TRANSIENT = (429, 500, 502, 503, 504)
+# of those, the ones that say the request wasn't acted on
+REFUSED = (429, 503)
+# requests that change nothing, so can always be tried again
+SAFE = ("GET", "REPORT")
+
+# a calendar-query for the resource of the VEVENT with a uid
+QUERY = """<?xml version="1.0" encoding="utf-8"?>
+<C:calendar-query xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav">
+  <D:prop><D:getetag/></D:prop>
+  <C:filter>
+    <C:comp-filter name="VCALENDAR">
+      <C:comp-filter name="VEVENT">
+        <C:prop-filter name="UID"><C:text-match collation="i;octet">%s</C:text-match></C:prop-filter>
+      </C:comp-filter>
+    </C:comp-filter>
+  </C:filter>
+</C:calendar-query>
+"""
+
+class push_error(Exception):
+    pass
+
+def instant(d):
+    ''' a RECURRENCE-ID (date or datetime) as a string that compares the same whatever its timezone '''
+
+    if isinstance(d, datetime):
+        return (d.astimezone(pytz.utc) if d.tzinfo else d).strftime("%Y%m%dT%H%M%S")
+    return d.strftime("%Y%m%d")
+
+def same_events(data, body):
+    ''' whether the calendar resource data has the same VEVENTs as body, though the
+        server may have written it out differently
+    '''
+
+    if data == body:
+        return True
+    try:
+        theirs = sorted(sub.to_ical() for sub in Calendar.from_ical(data).walk('VEVENT'))
+        ours = sorted(sub.to_ical() for sub in Calendar.from_ical(body).walk('VEVENT'))
+    except ValueError:
+        return False
+    return theirs == ours
+
+class caldav_push():
+
+    def __init__(self, url, workers=WORKERS, retries=RETRIES, backoff=BACKOFF):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise push_error("%s isn't an http or https url" % (url))
+
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path if parts.path.endswith("/") else parts.path + "/"
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+
+        self.headers = {'User-Agent': "perfcal"}
+        user = parts.username or os.environ.get("CALDAV_USER")
+        password = parts.password or os.environ.get("CALDAV_PASSWORD")
+        if user:
+            token = base64.b64encode(("%s:%s" % (user, password or "")).encode('utf-8')).decode('ascii')
+            self.headers['Authorization'] = "Basic " + token
+
+        # idle connections, to be reused
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.nrequests = 0
+        self.nconnections = 0
+
+    def connect(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            self.nconnections += 1
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(self.host, self.port, timeout=30)
+        return http.client.HTTPConnection(self.host, self.port, timeout=30)
+
+    def request(self, method, path, body=None, headers={}):
+        ''' send a request, on an idle connection if there is one. returns (status, etag, body).
+            raises push_error if it still fails after the retries.
+        '''
+
+        hdrs = dict(self.headers)
+        if body is not None:
+            hdrs['Content-Type'] = "text/calendar; charset=utf-8"
+        hdrs.update(headers)
+
+        why = None
+        # whether a change may have been made by a try that wasn't answered
+        unsure = False
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                diag.debug("caldav", "%s %s failed (%s), trying again", method, path, why)
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+            conn = self.connect()
+            with self.lock:
+                self.nrequests += 1
+            sent = False
+            try:
+                conn.request(method, path, body=body, headers=hdrs)
+                sent = True
+                resp = conn.getresponse()
+                data = resp.read()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                why = str(e) or e.__class__.__name__
+                if sent and method not in SAFE:
+                    unsure = True
+                    made = self.made(method, path, body)
+                    if made is not None:
+                        return made
+                continue
+
+            if resp.will_close:
+                conn.close()
+            else:
+                self.idle.put(conn)
+
+            if resp.status in TRANSIENT:
+                why = "%d %s" % (resp.status, resp.reason)
+                if resp.status not in REFUSED and method not in SAFE:
+                    unsure = True
+                    made = self.made(method, path, body)
+                    if made is not None:
+                        return made
+                continue
+            if resp.status == 412 and unsure:
+                # perhaps refused because an earlier try was made after all
+                made = self.made(method, path, body)
+                if made is not None:
+                    return made
+            return resp.status, resp.getheader('ETag'), data
+
+        raise push_error("%s %s: %s" % (method, path, why))
+
+    def made(self, method, path, body):
+        ''' after a PUT or DELETE that may or may not have been made, whether it was - the
+            answer of a GET of path that shows it was, else None
+        '''
+
+        st, etag, data = self.request("GET", path)
+        if method == "DELETE":
+            return (204, None, b"") if st == 404 else None
+        if st == 200 and same_events(data, body):
+            diag.debug("caldav", "%s %s was made, though its answer was lost", method, path)
+            return st, etag, data
+        return None
+
+    def href(self, uid):
+        return self.path + quote(str(uid), safe="@-_.") + ".ics"
+
+    def find(self, uid):
+        ''' the path of the resource with the event uid, by a calendar-query REPORT, or None '''
+
+        body = (QUERY % (escape(str(uid)))).encode('utf-8')
+        st, etag, data = self.request("REPORT", self.path, body,
+            {'Depth': "1", 'Content-Type': "application/xml; charset=utf-8"})
+        if st != 207:
+            diag.debug("caldav", "REPORT %s for %s: %d", self.path, uid, st)
+            return None
+        try:
+            root = ET.fromstring(data)
+        except ET.ParseError:
+            return None
+        for href in root.iter("{DAV:}href"):
+            if href.text:
+                return urlsplit(href.text.strip()).path
+        return None
+
+    def fetch(self, uid, path):
+        ''' GET the event uid, from path, or from where find() says it is.
+            returns (path, status, etag, body).
+        '''
+
+        st, etag, data = self.request("GET", path)
+        if st == 404:
+            found = self.find(uid)
+            if found is not None and found != path:
+                path = found
+                st, etag, data = self.request("GET", path)
+        return path, st, etag, data
+
+    def body(self, comps):
+        cal = Calendar()
+        cal.add('prodid', '-//Tuners Calendar//dfm//')
+        cal.add('version', '2.0')
+        for comp in comps:
+            cal.add_component(comp)
+        return cal.to_ical()
+
+    def send(self, chg, uid, items, dtstamp):
+        ''' send the changes [(s_e, event)] to the event uid, one after another. returns
+            {s_e: result}, result one of "sent", "conflict" or "failed".
+        '''
+
+        path = self.href(uid)
+        results = {}
+        try:
+            if any(ev.get('recurid') is not None for s_e, ev in items):
+                self.send_series(chg, uid, path, items, dtstamp, results)
+            else:
+                for s_e, ev in items:
+                    results[s_e] = self.send_one(chg, uid, path, s_e, ev, dtstamp)
+        except push_error as e:
+            diag.error("caldav", "couldn't send %s: %s", items[0][1]['title'], e)
+            for s_e, ev in items:
+                results.setdefault(s_e, "failed")
+        # this thread's messages are written by this thread
+        diag.flush()
+        return results
+
+    def conflict(self, ev, s_e, why):
+        diag.warn("caldav", "%s on %s not sent - %s", ev['title'], s_e[0].strftime("%b %d, %Y at %I:%M%p"), why)
+        return "conflict"
+
+    def send_one(self, chg, uid, path, s_e, ev, dtstamp):
+        status = ev.get('status')
+        if status is None:
+            st, etag, data = self.request("PUT", path, self.body([chg.vevent(s_e, ev, dtstamp, uid)]),
+                {'If-None-Match': "*"})
+            if st == 412:
+                return self.conflict(ev, s_e, "already in the calendar")
+        else:
+            path, st, etag, data = self.fetch(uid, path)
+            if st == 404:
+                return self.conflict(ev, s_e, "not in the calendar")
+            if st != 200:
+                raise push_error("GET %s: %d" % (path, st))
+
+            if status == 'CANCELLED':
+                st, etag, data = self.request("DELETE", path, headers={'If-Match': etag})
+            else:
+                st, etag, data = self.request("PUT", path, self.body([chg.vevent(s_e, ev, dtstamp, uid)]),
+                    {'If-Match': etag})
+            if st == 412:
+                return self.conflict(ev, s_e, "changed in the calendar since it was read")
+            if st == 404:
+                return self.conflict(ev, s_e, "gone from the calendar since it was read")
+
+        if st >= 300:
+            raise push_error("%s: %d" % (path, st))
+        return "sent"
+
+    def send_series(self, chg, uid, path, items, dtstamp, results):
+        ''' change instances of a recurring event: fetch the series, put the changed
+            instances in it, and send it back
+        '''
+
+        path, st, etag, data = self.fetch(uid, path)
+        if st != 200:
+            for s_e, ev in items:
+                results[s_e] = self.conflict(ev, s_e, "its series isn't in the calendar")
+            return
+
+        comps = [sub for sub in Calendar.from_ical(data).walk('VEVENT')]
+        for s_e, ev in items:
+            new = chg.vevent(s_e, ev, dtstamp, uid)
+            if ev.get('recurid') is not None:
+                rid = instant(new['RECURRENCE-ID'].dt)
+                comps = [sub for sub in comps if 'RECURRENCE-ID' not in sub or instant(sub['RECURRENCE-ID'].dt) != rid]
+            else:
+                comps = [sub for sub in comps if 'RECURRENCE-ID' in sub]
+            comps.append(new)
+
+        st, etag, data = self.request("PUT", path, self.body(comps), {'If-Match': etag})
+        for s_e, ev in items:
+            if st == 412:
+                results[s_e] = self.conflict(ev, s_e, "its series changed in the calendar since it was read")
+            elif st >= 300:
+                raise push_error("PUT %s: %d" % (path, st))
+            else:
+                results[s_e] = "sent"
+
+    def push(self, chg):
+        ''' send the changes in chg (an event_changes, after comparing). events sent are
+            noted in chg.emitted, as cal_events does. returns {s_e: result}.
+        '''
+
+        dtstamp = chg.stamp()
+
+        # changes to the same resource go one after another, in order
+        byuid = {}
+        for s_e in by_start(chg.events):
+            ev = chg.events[s_e]
+            byuid.setdefault(str(chg.uid_of(s_e, ev)), []).append((s_e, ev))
+
+        t0 = time.time()
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for res in pool.map(lambda uid: self.send(chg, uid, byuid[uid], dtstamp), byuid):
+                results.update(res)
+
+        while not self.idle.empty():
+            self.idle.get_nowait().close()
+
+        for s_e, res in results.items():
+            if res == "sent":
+                ev = chg.events[s_e]
+                chg.emitted[s_e] = (chg.uid_of(s_e, ev), ev.get('recurid'))
+
+        diag.debug("caldav", "%d requests on %d connections in %.2fs", self.nrequests, self.nconnections, time.time() - t0)
+        return results
+
+class stand_in(BaseHTTPRequestHandler):
+    ''' just enough of a CalDAV server to push to: GET, PUT and DELETE of resources,
+        kept in memory, with ETags and If-Match/If-None-Match, and a REPORT that finds
+        the resource of a uid. the server's fail, if
+        not 0, makes every fail'th request answer 503, and its lose every lose'th change
+        be made but not answered.
+    '''
+
+    protocol_version = "HTTP/1.1"
+
+    def answer(self, status, body=b"", etag=None):
+        self.send_response(status)
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def flaky(self):
+        srv = self.server
+        with srv.lock:
+            srv.nrequests += 1
+            n = srv.nrequests
+        if srv.delay:
+            time.sleep(srv.delay)
+        if srv.fail and n % srv.fail == 0:
+            self.answer(503)
+            return True
+        return False
+
+    def lost(self):
+        ''' whether to drop the connection instead of answering a change just made '''
+
+        srv = self.server
+        with srv.lock:
+            srv.nchanges += 1
+            n = srv.nchanges
+        if srv.lose and n % srv.lose == 0:
+            self.close_connection = True
+            return True
+        return False
+
+    def precondition(self, cur):
+        ''' whether the If-Match and If-None-Match headers allow a change to a resource
+            with ETag cur (None if there's no resource)
+        '''
+
+        match = self.headers.get('If-Match')
+        nomatch = self.headers.get('If-None-Match')
+        if match is not None and (cur is None or match not in ("*", cur)):
+            return False
+        if nomatch is not None and cur is not None and nomatch in ("*", cur):
+            return False
+        return True
+
+    def do_GET(self):
+        if self.flaky():
+            return
+        with self.server.lock:
+            res = self.server.store.get(self.path)
+        if res is None:
+            self.answer(404)
+        else:
+            self.answer(200, res[1], res[0])
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.flaky():
+            return
+        with self.server.lock:
+            cur = self.server.store.get(self.path)
+            if not self.precondition(cur[0] if cur else None):
+                self.answer(412)
+                return
+            etag = '"%s"' % (sha1(body).hexdigest()[:16])
+            self.server.store[self.path] = (etag, body)
+        if not self.lost():
+            self.answer(204 if cur else 201, etag=etag)
+
+    def do_DELETE(self):
+        if self.flaky():
+            return
+        with self.server.lock:
+            cur = self.server.store.get(self.path)
+            if cur is None:
+                self.answer(404)
+                return
+            if not self.precondition(cur[0]):
+                self.answer(412)
+                return
+            del self.server.store[self.path]
+        if not self.lost():
+            self.answer(204)
+
+    def do_REPORT(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.flaky():
+            return
+        try:
+            match = ET.fromstring(body).find(".//{urn:ietf:params:xml:ns:caldav}text-match")
+        except ET.ParseError:
+            self.answer(400)
+            return
+        uid = match.text if match is not None else None
+
+        found = []
+        with self.server.lock:
+            for href, (etag, data) in self.server.store.items():
+                if href.startswith(self.path) and uid is not None and any(str(sub.get('UID')) == uid
+                        for sub in Calendar.from_ical(data).walk('VEVENT')):
+                    found.append((href, etag))
+
+        resps = "".join("<D:response><D:href>%s</D:href><D:propstat><D:prop><D:getetag>%s</D:getetag>"
+            "</D:prop><D:status>HTTP/1.1 200 OK</D:status></D:propstat></D:response>" % (escape(href), escape(etag))
+            for href, etag in found)
+        self.answer(207, ('<?xml version="1.0" encoding="utf-8"?>\n<D:multistatus xmlns:D="DAV:">%s</D:multistatus>'
+            % (resps)).encode('utf-8'))
+
+    def log_message(self, fmt, *args):
+        pass
+
+def serve(port, path, icsfn=None, fail=0, delay=0.0, lose=0):
+    ''' run a stand_in server on port, for a calendar at path, starting with the events in icsfn '''
+
+    srv = ThreadingHTTPServer(("localhost", port), stand_in)
+    srv.daemon_threads = True
+    srv.lock = threading.Lock()
+    srv.store = {}
+    srv.nrequests = 0
+    srv.fail = fail
+    srv.delay = delay
+    srv.nchanges = 0
+    srv.lose = lose
+
+    if icsfn is not None:
+        with open(icsfn, "rb") as fo:
+            cal = Calendar.from_ical(fo.read())
+        series = {}
+        for sub in cal.walk('VEVENT'):
+            series.setdefault(str(sub['UID']), []).append(sub)
+        pusher = caldav_push("http://localhost%s" % (path))
+        for uid, comps in series.items():
+            body = pusher.body(comps)
+            srv.store[pusher.href(uid)] = ('"%s"' % (sha1(body).hexdigest()[:16]), body)
+        print("%d events from %s" % (len(series), icsfn))
+
+    print("CalDAV stand-in at http://localhost:%d%s" % (port, path))
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        print("\n%d requests, %d events in the calendar" % (srv.nrequests, len(srv.store)))
+
+def usage(msg="", error=0):
+    if msg != "":
+        print("\n>>> %s\n" % (msg))
+
+    print("""Usage: %s [-h] [-p port] [-c path] [-l file] [-f n] [-x n] [-d secs]
+   runs a stand-in CalDAV server, for trying out perfcal.py --caldav
+   where:
+      -h    show this help and exit
+      -p port => port to listen on (on localhost). default - 8008
+      -c path => path of the calendar. default - /tuners/
+      -l file => start with the events in .ics file (an export)
+      -f n => answer every n'th request with 503, to see it retried
+      -x n => make every n'th change but drop the connection instead of answering,
+                to see it checked before it's sent again
+      -d secs => wait secs before answering each request
+""" % (sys.argv[0]))
+
+    sys.exit(error)
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hp:c:l:f:x:d:")
+    except getopt.GetoptError as err:
+        usage(str(err), error=2)
+
+    port = 8008
+    path = "/tuners/"
+    icsfn = None
+    fail = 0
+    delay = 0.0
+    lose = 0
+    for o, a in opts:
+        if o == "-h":
+            usage()
+        elif o == "-p":
+            port = int(a)
+        elif o == "-c":
+            path = a if a.endswith("/") else a + "/"
+        elif o == "-l":
+            icsfn = a
+        elif o == "-f":
+            fail = int(a)
+        elif o == "-x":
+            lose = int(a)
+        elif o == "-d":
+            delay = float(a)
+
+    serve(port, path, icsfn, fail, delay, lose)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+'''
+    conflict report for a set of events: bookings which overlap each other, and
+    performances which fall inside someone's absence.
+
+    absences are taken to end when they really do (tuner_events.event_end), not a
+    day later as the workbook has them for google.
+
+    the events are sorted once by start time and swept in that order. each kind
+    (bookings, absences) keeps a heap of the events still in progress, ordered by end
+    time, so finished ones drop off in log time. total cost is O(n log n) plus the
+    number of conflicts found.
+'''
+
+import heapq
+
+from tuner_events import event_kind, event_end
+from event_map import by_start
+
+def find_conflicts(events):
+    ''' events is a dict of {(start, end): event}.
+        returns (overlaps, absent):
+            overlaps - list of (s_e1, s_e2) bookings which overlap, s_e1 starting first
+            absent - dict of {performance s_e: [absence s_e, ...]}
+    '''
+
+    overlaps = []
+    absent = {}
+
+    booked = []         # heap of (end, s_e) for rehearsals, performances, board mtgs
+    away = []           # heap of (end, s_e) for absences
+
+    for s_e in by_start(events):
+        (evst, evend) = s_e
+        kind = event_kind(events[s_e])
+
+        # anything that ended by the time this starts can't conflict with it, or anything later
+        while booked and booked[0][0] <= evst:
+            heapq.heappop(booked)
+        while away and away[0][0] <= evst:
+            heapq.heappop(away)
+
+        if kind == 'a':
+            # performances still going when this absence starts
+            for (end, other) in booked:
+                if event_kind(events[other]) == 'p':
+                    absent.setdefault(other, []).append(s_e)
+            heapq.heappush(away, (event_end(s_e, events[s_e]), s_e))
+            continue
+
+        for (end, other) in booked:
+            overlaps.append((other, s_e))
+
+        if kind == 'p':
+            for (end, other) in away:
+                absent.setdefault(s_e, []).append(other)
+
+        heapq.heappush(booked, (evend, s_e))
+
+    return overlaps, absent
+
+def conflict_report(evset):
+    ''' print the conflicts in a tuner_events set. returns the number found. '''
+
+    events = evset.events
+    overlaps, absent = find_conflicts(events)
+
+    def line(s_e):
+        (evst, evend) = s_e
+        ev = events[s_e]
+        if event_kind(ev) == 'a':
+            when = "{:%m/%d/%Y} - {:%m/%d/%Y}".format(evst, event_end(s_e, ev))
+        else:
+            when = "{:%m/%d/%Y %I:%M %p} - {:%I:%M %p}".format(evst, evend)
+        ven = ev.get('venue') or ""
+        if ven and ven != ev['title']:
+            return "{}  {} at {}".format(when, ev['title'], ven)
+        return "{}  {}".format(when, ev['title'])
+
+    print("\nConflict report for %d events from %s" % (len(events), evset.infile))
+
+    print("\n%d overlapping bookings" % (len(overlaps)))
+    for s_e1, s_e2 in overlaps:
+        print("  %s" % (line(s_e1)))
+        print("  %s\n" % (line(s_e2)))
+
+    print("\n%d performances during absences" % (len(absent)))
+    for s_e in sorted(absent):
+        print("  %s" % (line(s_e)))
+        members = ", ".join(str(events[a]['title']) for a in sorted(absent[s_e]))
+        print("    absent: %s\n" % (members))
+
+    return len(overlaps) + len(absent)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+'''
+    find events that are in more than one calendar of a google export zip.
+
+    an event copied from one calendar to another (or entered in both) shows up
+    twice once the calendars are merged, maybe a few minutes apart, and then gets
+    compared - and updated - twice. each event is filed under a few normalized
+    keys: its uid, and its title and venue in a slot of WINDOW minutes. an event
+    only has to be checked against the events filed under the same keys in its
+    own slot and the ones on either side, so the whole set takes one pass.
+
+    of a pair, the event in the calendar it belongs in is kept - absences and
+    board meetings in tunersboardabs<yr>, the rest in tuners<yr>.
+'''
+
+import re
+from datetime import timedelta
+from event_map import by_start
+
+# how far apart the start and end of two copies of an event can be
+WINDOW = timedelta(minutes=30)
+
+def norm(s):
+    ''' text with case, punctuation and spacing that don't matter taken out '''
+
+    return " ".join(re.sub(r"[^\w\s]", " ", str(s or "")).lower().split())
+
+def owner(ev):
+    ''' whether ev is in the calendar it belongs in '''
+
+    boardabs = "boardabs" in ev.get('cal', "")
+    return boardabs == (ev.get('type') in ["absences", "Meeting"])
+
+def close(s_e1, s_e2, window):
+    return abs(s_e1[0] - s_e2[0]) <= window and abs(s_e1[1] - s_e2[1]) <= window
+
+def find_duplicates(events, clashes, calorder, window=WINDOW):
+    ''' events is {s_e: event} merged from several calendars, each event's calendar in
+        its 'cal' field. clashes is [(s_e, event)] of events left out of events because
+        another calendar's event already had their start and end.
+
+        returns [(keep, drop, why)] - keep and drop are (s_e, event) pairs - for the
+        duplicates found across calendars, and [(s_e, event)] of the clashes that aren't
+        duplicates, just two different things booked at the same time.
+    '''
+
+    wsecs = max(int(window.total_seconds()), 1)
+    filed = {}
+    dups = []
+    taken = set()
+
+    def better(a, b):
+        ''' of two copies (s_e, event), the one to keep '''
+        oa, ob = owner(a[1]), owner(b[1])
+        if oa != ob:
+            return a if oa else b
+        ia = calorder.index(a[1].get('cal')) if a[1].get('cal') in calorder else len(calorder)
+        ib = calorder.index(b[1].get('cal')) if b[1].get('cal') in calorder else len(calorder)
+        return a if (ia, a[0]) <= (ib, b[0]) else b
+
+    for s_e in by_start(events):
+        ev = events[s_e]
+        slot = int(s_e[0].timestamp()) // wsecs
+        keys = [('text', norm(ev.get('title')), norm(ev.get('venue')))]
+        if ev.get('uid'):
+            keys.append(('uid', str(ev['uid'])))
+
+        match = None
+        for key in keys:
+            for sl in (slot - 1, slot, slot + 1):
+                for other in filed.get((key, sl), []):
+                    if other in taken or events[other].get('cal') == ev.get('cal'):
+                        continue
+                    if close(s_e, other, window):
+                        match = (other, "same uid" if key[0] == 'uid' else "same title and venue")
+                        break
+                if match:
+                    break
+            if match:
+                break
+
+        if match is not None:
+            other, why = match
+            keep = better((other, events[other]), (s_e, ev))
+            drop = (s_e, ev) if keep[0] == other else (other, events[other])
+            dups.append((keep, drop, why))
+            taken.add(drop[0])
+            if keep[0] == other:
+                continue
+
+        for key in keys:
+            filed.setdefault((key, slot), []).append(s_e)
+
+    # an event at exactly the time of another calendar's is a duplicate if it's the
+    # same event, else a real clash
+    conflicts = []
+    for s_e, ev in clashes:
+        cur = events[s_e]
+        if norm(cur.get('title')) == norm(ev.get('title')) or (ev.get('uid') and ev.get('uid') == cur.get('uid')):
+            keep = better((s_e, cur), (s_e, ev))
+            drop = (s_e, ev) if keep[1] is cur else (s_e, cur)
+            dups.append((keep, drop, "same time"))
+        else:
+            conflicts.append((s_e, ev))
+
+    return dups, conflicts
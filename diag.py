@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+'''
+    diagnostics - the messages printed while events are loaded and compared.
+
+    each message has a level (error, warn, info, debug) and a category ("overlap",
+    "venue", "changed"...). every message is counted by category, but one below the
+    level set is never even formatted, so a quiet run costs little more than the
+    count. the ones shown are kept in a buffer and written out in a batch - to the
+    terminal, a text file, or a file of json lines - when it fills, or at flush().
+
+    summary() says how many of each category weren't shown. a caller that wants the
+    messages rather than have them shown - a program using this as a library - can
+    capture() them, and release() them when it's done.
+
+        import diag
+        diag.warn("venue", "didn't recognize %s as a valid venue???", venue)
+'''
+
+import sys
+import json
+import time
+import threading
+from collections import Counter
+
+ERROR, WARN, INFO, DEBUG = range(4)
+NAMES = ["error", "warn", "info", "debug"]
+
+# messages held before they're written
+BUFSIZE = 256
+
+class sink():
+    ''' where shown messages go. fo of None is the terminal - whatever sys.stdout is
+        when the buffer is written, so output captured by a caller (or a job's
+        buffer) gets its own messages. with asjson, each message is a line of json.
+    '''
+
+    def __init__(self, fo=None, asjson=False):
+        self.fo = fo
+        self.asjson = asjson
+        # each thread has its own buffer, so messages from jobs run side by side
+        # aren't mixed up
+        self.local = threading.local()
+
+    def buffer(self):
+        buf = getattr(self.local, "buf", None)
+        if buf is None:
+            buf = self.local.buf = []
+        return buf
+
+    def emit(self, level, cat, msg):
+        kept = getattr(self.local, "kept", None)
+        if kept is not None:
+            kept.append((level, cat, msg))
+            return
+        buf = self.buffer()
+        buf.append((level, cat, msg))
+        if len(buf) >= BUFSIZE:
+            self.flush()
+
+    def flush(self):
+        buf = self.buffer()
+        if len(buf) == 0:
+            return
+        if self.asjson:
+            now = time.time()
+            text = "".join(json.dumps({'time': now, 'level': NAMES[level], 'cat': cat, 'msg': msg}) + "\n"
+                for level, cat, msg in buf)
+        else:
+            text = "".join(msg + "\n" for level, cat, msg in buf)
+        del buf[:]
+
+        fo = self.fo if self.fo is not None else sys.stdout
+        fo.write(text)
+        fo.flush()
+
+    def close(self):
+        self.flush()
+        if self.fo is not None:
+            self.fo.close()
+
+# the settings for this process
+level = INFO
+counts = Counter()
+shown = Counter()
+out = sink()
+# the file out writes to, for worker processes to write to too
+logname = None
+
+def setup(lvl=None, logfn=None):
+    ''' set the level, and send messages to logfn (json lines if it ends .json or .jsonl) '''
+
+    global level, out, logname
+    if lvl is not None:
+        level = lvl
+    if logfn is not None:
+        out.flush()
+        logname = logfn
+        out = sink(open(logfn, "a"), asjson=logfn.endswith(".json") or logfn.endswith(".jsonl"))
+
+def log(lvl, cat, fmt, *args):
+    counts[cat] += 1
+    if lvl > level:
+        return
+    shown[cat] += 1
+    out.emit(lvl, cat, fmt % args if args else fmt)
+
+def count(cat):
+    ''' count a message that won't be shown, without making it '''
+
+    counts[cat] += 1
+
+def error(cat, fmt, *args):
+    log(ERROR, cat, fmt, *args)
+
+def warn(cat, fmt, *args):
+    log(WARN, cat, fmt, *args)
+
+def info(cat, fmt, *args):
+    log(INFO, cat, fmt, *args)
+
+def debug(cat, fmt, *args):
+    log(DEBUG, cat, fmt, *args)
+
+def flush():
+    out.flush()
+
+def capture():
+    ''' keep this thread's messages for release(), instead of showing them '''
+
+    out.local.kept = []
+
+def release():
+    ''' stop keeping this thread's messages. returns [(level, category, message)] of
+        the ones kept since capture()
+    '''
+
+    kept = getattr(out.local, "kept", None) or []
+    out.local.kept = None
+    return kept
+
+def replay(kept):
+    ''' messages kept by capture() (from release), put where they would have gone: to
+        the log file, if there is one. else they're returned as text, for the caller
+        to print when it's ready.
+    '''
+
+    if out.fo is not None:
+        for lvl, cat, msg in kept:
+            out.emit(lvl, cat, msg)
+        out.flush()
+        return ""
+    return "".join(msg + "\n" for lvl, cat, msg in kept)
+
+def take_counts():
+    ''' the counts so far (for a loader process to hand back), which are then cleared '''
+
+    flush()
+    cts = (dict(counts), dict(shown))
+    counts.clear()
+    shown.clear()
+    return cts
+
+def merge(cts):
+    ''' add in counts from take_counts in another process '''
+
+    counts.update(cts[0])
+    shown.update(cts[1])
+
+def summary():
+    ''' say how many messages of each category weren't shown '''
+
+    hidden = counts - shown
+    if hidden:
+        cats = ", ".join("%s %d" % (cat, n) for cat, n in sorted(hidden.items()))
+        out.emit(INFO, "summary", "%d messages not shown (%s) - -v shows more" % (sum(hidden.values()), cats))
+    flush()
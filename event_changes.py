@@ -7,17 +7,237 @@
 
 import os, sys
 from zipfile import ZipFile
-from icalendar import Calendar, Event, tools
+from icalendar import Calendar, Event
+from hashlib import sha1
 from datetime import datetime, timedelta, timezone
 import pytz
 from os.path import splitext
 from csv import DictWriter
+from recurrence import find_series
+from workbook_update import update_workbook
+from tuner_events import event_kind
+from event_map import event_map, by_start, by_month
+import json
+import heapq
+import diag
+
+# event fields given in change feed records
+FEEDFIELDS = ['title', 'venue', 'uni', 'type']
+
+# times in change messages
+PFMT = "%b %d, %Y at %I:%M%p"
+
+def key_index(evsets):
+    ''' merged index of the events in several event sets - {s_e: n} where bit i of n
+        is set if the event is in evsets[i]
+    '''
+
+    index = {}
+    for i, evs in enumerate(evsets):
+        bit = 1 << i
+        for s_e in evs.events:
+            index[s_e] = index.get(s_e, 0) | bit
+    return index
+
+def event_uids(events, host="twotowntuners.org"):
+    ''' a uid for each of events ({s_e: event}). events from a calendar keep theirs. the
+        others get one made from the kind of event, its date and its place among that
+        day's events of the kind - so regenerating an update gives the same uids.
+    '''
+
+    uids = {}
+    seq = {}
+    for s_e in by_start(events):
+        uids[s_e] = next_uid(seq, s_e, events[s_e], host)
+    return uids
+
+def next_uid(seq, s_e, ev, host="twotowntuners.org"):
+    ''' the uid for ev, the next event in order. seq counts the events of each kind
+        on each day so far.
+    '''
+
+    day = (event_kind(ev), s_e[0].date().isoformat())
+    n = seq.get(day, 0)
+    seq[day] = n + 1
+    if ev.get('uid'):
+        return ev['uid']
+    key = "%s|%s|%d" % (day[0], day[1], n)
+    return "%s@%s" % (sha1(key.encode('utf-8')).hexdigest()[:24], host)
+
+def free_uid(uid, taken):
+    ''' uid, or if it's one of taken, another made from it that isn't '''
+
+    name, host = uid.split("@", 1)
+    n = 1
+    new = uid
+    while new in taken:
+        new = "%s-%d@%s" % (name, n, host)
+        n += 1
+    return new
+
+def stream_changes(cur, old, window=timedelta(days=1)):
+    ''' compare two streams of (s_e, event), each in order, in one pass - a merge join.
+        yields the same change feed records as event_changes.changes(), as they're found.
+
+        an event on just one side is held for window, in case it's the other side of a
+        move (the same uid at another time), then is an add or a cancel. only the events
+        held, and the counts for today's uids, are kept - not the whole of either side.
+    '''
+
+    def tagged(events, side):
+        for n, (s_e, ev) in enumerate(events):
+            yield s_e, side, n, ev
+
+    held_cur = {}       # s_e => (event, uid)
+    held_old = {}       # s_e => event
+    curuids = {}        # uid => s_e, for held_cur
+    olduids = {}        # uid => s_e, for held_old
+    seq = {}
+    last = [None, None]
+    pending = None      # a current event, waiting to see if old has the same s_e
+
+    def change(action, s_e, fields, uid):
+        (evstrt, evend) = s_e
+        return {'action': action, 'key': [evstrt.isoformat(), evend.isoformat()], 'uid': uid, 'fields': fields}
+
+    def unmatched_cur(s_e, ev):
+        # joined as changes() joins - an event with no match at its time, on its uid,
+        # read or made up
+        uid = next_uid(seq, s_e, ev)
+        olds_e = olduids.pop(uid, None)
+        if olds_e is None:
+            held_cur[s_e] = (ev, uid)
+            curuids[uid] = s_e
+            return None
+        return moved(s_e, ev, olds_e, held_old.pop(olds_e))
+
+    def unmatched_old(s_e, ev):
+        s_e2 = curuids.pop(ev.get('uid'), None) if ev.get('uid') else None
+        if s_e2 is None:
+            held_old[s_e] = ev
+            if ev.get('uid'):
+                olduids[ev['uid']] = s_e
+            return None
+        cev, uid = held_cur.pop(s_e2)
+        return moved(s_e2, cev, s_e, ev)
+
+    def moved(s_e, ev, olds_e, oldev):
+        diag.info("moved", "%s moved from %s to %s", ev['title'], olds_e[0].strftime(PFMT), s_e[0].strftime(PFMT))
+        fields = {'start': [olds_e[0].isoformat(), s_e[0].isoformat()],
+            'end': [olds_e[1].isoformat(), s_e[1].isoformat()]}
+        for f in FEEDFIELDS:
+            if (ev.get(f) or "") != (oldev.get(f) or ""):
+                fields[f] = [oldev.get(f), ev.get(f)]
+        return change('modify', s_e, fields, oldev['uid'])
+
+    def matched(s_e, ev, oldev):
+        next_uid(seq, s_e, ev)
+        fields = {}
+        for f, dflt in [('title', None), ('venue', None), ('uni', "")]:
+            if ev.get(f, dflt) != oldev.get(f, dflt):
+                diag.info("changed", "%s changed from %s to %s on event at %s", f, oldev.get(f, ""), ev.get(f, ""),
+                    s_e[0].strftime(PFMT))
+                fields[f] = [oldev.get(f, dflt), ev.get(f, dflt)]
+        if fields:
+            return change('modify', s_e, fields, oldev.get('uid', ev.get('uid')))
+        return None
+
+    def expire(before):
+        ''' adds and cancels for the held events that started before before '''
+
+        for s_e in sorted(s_e for s_e in held_cur if before is None or s_e[0] < before):
+            ev, uid = held_cur.pop(s_e)
+            curuids.pop(uid, None)
+            diag.info("new", "New event: %s from %s to %s", ev['title'], s_e[0].strftime(PFMT), s_e[1].strftime(PFMT))
+            yield change('add', s_e, dict((f, [None, ev[f]]) for f in FEEDFIELDS if f in ev), ev.get('uid'))
+
+        for s_e in sorted(s_e for s_e in held_old if before is None or s_e[0] < before):
+            ev = held_old.pop(s_e)
+            olduids.pop(ev.get('uid'), None)
+            if str(ev.get('uid', "")).endswith('google.com'):
+                diag.warn("manual", "\nrefusing to drop this manually added event:\n  %s from %s to %s (%s)",
+                    ev['title'], s_e[0].strftime(PFMT), s_e[1].strftime(PFMT), s_e[1] - s_e[0])
+                continue
+            diag.info("deleted", "Deleted event: %s from %s to %s", ev['title'], s_e[0].strftime(PFMT),
+                s_e[1].strftime(PFMT))
+            yield change('cancel', s_e, dict((f, [ev[f], None]) for f in FEEDFIELDS if f in ev), ev.get('uid'))
+
+    for s_e, side, n, ev in heapq.merge(tagged(cur, 0), tagged(old, 1)):
+        if last[side] is not None and s_e <= last[side]:
+            diag.warn("order", "%s at %s is out of order, or there twice - skipped", ev['title'],
+                s_e[0].strftime(PFMT))
+            continue
+        last[side] = s_e
+
+        rec = None
+        if pending is not None and side == 1 and pending[0] == s_e:
+            rec = matched(s_e, pending[1], ev)
+            pending = None
+        else:
+            if pending is not None:
+                rec = unmatched_cur(*pending)
+                pending = None
+            if rec is not None:
+                yield rec
+                rec = None
+            if side == 0:
+                pending = (s_e, ev)
+            else:
+                rec = unmatched_old(s_e, ev)
+
+        if rec is not None:
+            yield rec
+
+        # today's events can still be counted for uids; earlier days can't
+        today = s_e[0].date().isoformat()
+        for day in [day for day in seq if day[1] < today]:
+            del seq[day]
+
+        yield from expire(s_e[0] - window)
+
+    if pending is not None:
+        rec = unmatched_cur(*pending)
+        if rec is not None:
+            yield rec
+    yield from expire(None)
+
+def event_times(evst, evend):
+    ''' day and times of an event, as listed '''
+
+    if evend.day == evst.day:
+        return "{:%d (%a), %I:%M %p} - {:%I:%M %p}".format(evst, evend)
+    return "{:%d (%a) %I:%M %p} - {:%d (%a) at %I:%M %p}".format(evst, evend)
+
+def event_label(title, ven, uni):
+    ''' what an event is called in listings - title, venue and uniform '''
+
+    if title == ven:
+        evnam = ven
+    elif 'Rehearsal' in title and ven == "Lewis & Clark Evt Ctr":
+        evnam = title
+    elif title == 'Board Meeting' and ven == "Lewis & Clark Evt Ctr":
+        evnam = title
+    else:
+        evnam = "{} at {}".format(title, ven)
+
+    if uni and uni != "" and uni != "- none -":
+        if uni == "singout":
+            evnam = "{}, UNIFORM: black shirt, blue tie".format(evnam)
+        elif uni == "contest":
+            evnam = "{}, UNIFORM: black shirt, blue tie, blue vest".format(evnam)
+        else:
+            evnam = "{}, UNIFORM: {}".format(evnam, uni)
+
+    return evnam
 
 class event_changes():
-    def __init__(self, complist, show_detail=True):
-        ''' complist has two event classes to be compared '''
+    def __init__(self, complist, show_detail=True, rrules=False, state=None):
+        ''' complist has two event classes to be compared.
+            with rrules, regular patterns of new events are written to .ics as series.
+            state (a sync_state) drops changes which earlier runs already wrote.
+        '''
 
-        self.events = {}
+        self.events = event_map()
         self.venue_addrs = complist[0].venue_addrs
         self.complist = complist
 
@@ -29,50 +249,147 @@ class event_changes():
             self.class2 = None
 
         self.show_detail = show_detail
+        self.rrules = rrules
+        self.state = state
+
+        # s_e => (uid, recurid) of each event written by cal_events
+        self.emitted = {}
+
+        # the uid each current event is (or will be) known by
+        self.uids = event_uids(self.class1.events)
 
     def add(self, s_e, event):
         # event in current but not old, add it
         self.events[s_e] = event
         if self.show_detail:
             evfrom, evto = s_e
-            print("New event: {} from {:%b %d, %Y at %I:%M%p} to {:%b %d, %Y at %I:%M%p}".format(event['title'], evfrom, evto))
+            diag.info("new", "New event: %s from %s to %s", event['title'], evfrom.strftime(PFMT), evto.strftime(PFMT))
     
     def drop(self, s_e, event):
         # event in old but not current, drop it
         if 'uid' in event and event['uid'].endswith('google.com'):
             (evstrt, evend) = s_e
-            dt = evend - evstrt
-            print("\nrefusing to drop this manually added event:")
-            pfmt = "%b %d, %Y at %I:%M%p"
-            print("  %s from %s to %s (%s)" % (event['title'], evstrt.strftime(pfmt),
-                evend.strftime(pfmt), dt))
-            return
+            diag.warn("manual", "\nrefusing to drop this manually added event:\n  %s from %s to %s (%s)",
+                event['title'], evstrt.strftime(PFMT), evend.strftime(PFMT), evend - evstrt)
+            return False
 
-        self.events[s_e] = event
-        self.events[s_e]['status'] = 'CANCELLED'
+        # a copy - the old set may be compared again
+        self.events[s_e] = dict(event, status='CANCELLED')
 
         if self.show_detail:
             (evstrt, evend) = s_e
-            print("Deleted event: {} from {:%b %d, %Y at %I:%M%p} to {:%b %d, %Y at %I:%M%p}".format(self.class2.events[s_e]['title'], evstrt, evend))
+            diag.info("deleted", "Deleted event: %s from %s to %s", self.class2.events[s_e]['title'], evstrt.strftime(PFMT),
+                evend.strftime(PFMT))
+
+        return True
 
     def modify(self, s_e, event, field):
         # event in both old and current, modify it
-        self.events[s_e] = event
-        self.events[s_e]['status'] = 'MODIFIED'
+        oldev = self.class2.events[s_e]
+        if 'recurid' in oldev:
+            # one instance of a recurring series - change just that instance
+            event = dict(event, uid=oldev['uid'], recurid=oldev['recurid'])
+        elif 'uid' in oldev:
+            # change the event the calendar has, not make another
+            event = dict(event, uid=oldev['uid'])
+
+        # a copy - the current set may be compared with another old one
+        self.events[s_e] = dict(event, status='MODIFIED')
         if self.show_detail:
             oldf = self.class2.events[s_e].get(field, "")
             newf = event.get(field, "")
             (evstrt, evend) = s_e
-            print("{} changed from {} to {} on event at {:%b %d, %Y at %I:%M%p}".format(field, oldf, newf, evstrt))
+            diag.info("changed", "%s changed from %s to %s on event at %s", field, oldf, newf, evstrt.strftime(PFMT))
+
+    def move(self, s_e, event, olds_e):
+        # event in current has the uid of an old event at another time - move it
+        oldev = self.class2.events[olds_e]
+        event = dict(event, uid=oldev['uid'], status='MODIFIED')
+        if 'recurid' in oldev:
+            event['recurid'] = oldev['recurid']
+        self.events[s_e] = event
+
+        if self.show_detail:
+            diag.info("moved", "%s moved from %s to %s", event['title'], olds_e[0].strftime(PFMT), s_e[0].strftime(PFMT))
 
     def dump_events(self, logfile=None):
         with open(logfile, "a") as log:
             log.write("\nDumping changed events\n")
-            for s_e in sorted(self.events):
+            for s_e in by_start(self.events):
                 (evstrt, evend) = s_e
                 dt = evend - evstrt
                 log.write("\n%s %s %s\n%s\n" % (evstrt, evend, dt, self.events[s_e]))
 
+    def vevent(self, s_e, ev, dtstamp, uid):
+        ''' make the VEVENT for one event '''
+
+        (evstrt, evend) = s_e
+        event = Event()
+
+        if 'status' in ev:
+            if ev['status'] == 'CANCELLED':
+                # print("%s %s going away" % (ev['title'], evstrt.strftime("%Y-%m-%d %I:%M%p")))
+                event['status'] = 'CANCELLED'
+            elif ev['status'] == 'MODIFIED':
+                # print("%s %s changed" % (ev['title'], evstrt.strftime("%Y-%m-%d %I:%M%p")))
+                event['status'] = 'CONFIRMED'
+
+        evtitl = ev['title']
+        if 'venue' in ev:
+            venue = ev['venue']
+            if venue in self.venue_addrs:
+                a1, a2 = self.venue_addrs[venue]
+                locn = "%s\n%s\n%s" % (venue, a1, a2)
+                event.add('location', locn)
+
+        desc = []
+        if 'uni' in ev and ev['uni']:
+            desc.append("UNIFORM:" + ev['uni'])
+        if 'type' in ev and ev['type']:
+            desc.append("EVENT_TYPE:" + ev['type'])
+
+        if len(desc) > 0:
+            event.add('description', "\n".join(desc))
+
+        recurid = ev.get('recurid')
+
+        if evstrt.hour == 0:
+            # make date objects from the datetime objects
+            # so calendar treats as "all day"
+            evstrt = evstrt.date()
+            evend = evend.date()
+            if recurid is not None:
+                recurid = recurid.date()
+
+        event.add('summary', evtitl)
+        event.add('dtstart', evstrt)
+        event.add('dtend', evend)
+        event.add('dtstamp', dtstamp)
+        if recurid is not None:
+            # one instance of a recurring event
+            event.add('recurrence-id', recurid)
+        if 'sequence' in ev:
+            event.add('sequence', ev['sequence'])
+        event['uid'] = uid
+
+        return event
+
+    def stamp(self):
+        ''' the DTSTAMP for the events written: the time the current file was saved,
+            so the same changes always make the same file
+        '''
+
+        if self.class1.infile and os.path.exists(self.class1.infile):
+            return datetime.utcfromtimestamp(int(os.path.getmtime(self.class1.infile)))
+        return datetime.utcnow().replace(microsecond=0)
+
+    def uid_of(self, s_e, ev):
+        ''' the uid a changed event is written with - the one it has, or the one made for it '''
+
+        if 'uid' in ev:
+            return ev['uid']
+        return self.uids.get(s_e) or event_uids({s_e: ev})[s_e]
+
     def cal_events(self, ofn=None):
         ''' write a new ics file with the changed events '''
 
@@ -80,60 +397,55 @@ class event_changes():
         cal.add('prodid', '-//Tuners Calendar//dfm//')
         cal.add('version', '2.0')
 
-        uidgen = tools.UIDGenerator()
-        dtstamp = datetime.utcnow()
-        
-        nev = 0
-        for s_e in sorted(self.events):
-            (evstrt, evend) = s_e
-            event = Event()
+        dtstamp = self.stamp()
 
-            ev = self.events[s_e]
-            if 'status' in ev:
-                if ev['status'] == 'CANCELLED':
-                    # print("%s %s going away" % (ev['title'], evstrt.strftime("%Y-%m-%d %I:%M%p")))
-                    event['status'] = 'CANCELLED'
-                elif ev['status'] == 'MODIFIED':
-                    # print("%s %s changed" % (ev['title'], evstrt.strftime("%Y-%m-%d %I:%M%p")))
-                    event['status'] = 'CONFIRMED'
-
-            evtitl = ev['title']
-            if 'venue' in ev:
-                venue = ev['venue']
-                if venue in self.venue_addrs:
-                    a1, a2 = self.venue_addrs[venue]
-                    locn = "%s\n%s\n%s" % (venue, a1, a2)
-                    event.add('location', locn)
-
-            desc = []
-            if 'uni' in ev and ev['uni']:
-                desc.append("UNIFORM:" + ev['uni'])
-            if 'type' in ev and ev['type']:
-                desc.append("EVENT_TYPE:" + ev['type'])
-
-            if len(desc) > 0:
-                event.add('description', "\n".join(desc))
-
-            if evstrt.hour == 0:
-                # make date objects from the datetime objects
-                # so calendar treats as "all day"
-                evstrt = evstrt.date()
-                evend = evend.date()
-
-            event.add('summary', evtitl)
-            event.add('dtstart', evstrt)
-            event.add('dtend', evend)
-            event.add('dtstamp', dtstamp)
-            if 'uid' in ev:
-                event['uid'] = ev['uid']
-                # print("old uid %s" % (event['uid']))
-            else:
-                event['uid'] = uidgen.uid(host_name="twotowntuners.org")
-                # print("gend uid %s" % (event['uid']))
+        # (sort key, VEVENT) - written in order of start time
+        comps = []
+        singles = dict(self.events)
+        nev = 0
+        nser = 0
+
+        if self.rrules:
+            # only events new to the calendar can be folded into a series. (changes
+            # and cancels refer to events, or instances, that are already there.)
+            fresh = {}
+            for s_e, ev in self.events.items():
+                if s_e[0].hour != 0 and not ('status' in ev or 'uid' in ev or 'recurid' in ev):
+                    fresh[s_e] = ev
+
+            for ser in find_series(fresh):
+                # the series goes by the uid of its first instance
+                uid = self.uids[ser['first']]
+
+                master = self.vevent(ser['first'], ser['fields'], dtstamp, uid)
+                master.add('rrule', ser['rule'])
+                if ser['exdates']:
+                    master.add('exdate', ser['exdates'])
+                comps.append((ser['first'], master))
+
+                for s_e, ev in ser['overrides'].items():
+                    comps.append((s_e, self.vevent(s_e, dict(ev, recurid=s_e[0]), dtstamp, uid)))
+
+                for s_e in ser['instances']:
+                    del singles[s_e]
+                    self.emitted[s_e] = (uid, s_e[0])
+                nev += len(ser['instances'])
+                nser += 1
+
+        for s_e in singles:
+            ev = singles[s_e]
+            uid = self.uid_of(s_e, ev)
+
+            comps.append((s_e, self.vevent(s_e, ev, dtstamp, uid)))
+            self.emitted[s_e] = (uid, ev.get('recurid'))
+            nev += 1
 
+        for s_e, event in sorted(comps, key=lambda c: c[0]):
             # print(event)
             cal.add_component(event)
-            nev += 1
+
+        if nser > 0:
+            diag.info("series", "%d events written as %d series, %d single events", nev - len(singles), nser, len(singles))
 
         if nev > 0:
             f = open(ofn, 'w', newline='')
@@ -146,9 +458,13 @@ class event_changes():
 
         return nev
 
-    def output_events(self, ofn=None):
+    def write_events(self, ofn=None):
+        ''' write the changes to ofn, as .ics, .csv or .xlsx by its extension. returns
+            how many were written.
+        '''
+
         if ofn is None:
-            return
+            return 0
 
         (_, ext) = splitext(ofn)
         nev = 0
@@ -156,43 +472,154 @@ class event_changes():
             nev = self.cal_events(ofn)
         elif ext == ".csv":
             nev = self.csv_events(ofn)
+        elif ext == ".xlsx":
+            nev = self.xlsx_events(ofn)
+        return nev
 
+    def output_events(self, ofn=None):
+        nev = self.write_events(ofn)
+        diag.flush()
         if nev > 0:
             print("Wrote %d events to %s" % (nev, ofn))
-        
-    def comp_events(self, list_changes=True):
-        ''' compare events '''
 
-        for s_e in sorted(self.class1.events):
-            ev = self.class1.events[s_e]
+        return nev
 
+    def screened(self, action, s_e, fields):
+        ''' a change to s_e was just put in self.events. check it against the sync state,
+            if any, and return its change feed record - or None if it was already sent.
+        '''
+
+        ev = self.events[s_e]
+        if self.state is not None:
+            ev = self.state.screen(s_e, ev)
+            if ev is None:
+                del self.events[s_e]
+                self.ndrop += 1
+                return None
+            self.events[s_e] = ev
+
+        (evstrt, evend) = s_e
+        return {'action': action, 'key': [evstrt.isoformat(), evend.isoformat()],
+            'uid': ev.get('uid'), 'fields': fields}
+
+    def changes(self):
+        ''' compare events, yielding a change feed record for each add, modify or cancel
+            as it is found. {'action': , 'key': [start, end], 'uid': , 'fields': {name: [old, new]}}.
+            the changes are also kept in self.events for the output files.
+        '''
+
+        self.ndrop = 0
+
+        # old events no longer at their time, by uid - a current event with no match at
+        # its time, and the same uid (read, or made up by event_uids), has moved there.
+        # an event matched at its time is never taken for another.
+        olduids = {}
+        # the uids the calendar has already - an added event mustn't be given one
+        taken = set()
+        if self.class2 is not None:
+            for s_e, ev in self.class2.events.items():
+                if ev.get('uid'):
+                    taken.add(ev['uid'])
+                    if s_e not in self.class1.events:
+                        olduids[ev['uid']] = s_e
+        moved = set()
+
+        for s_e in by_start(self.class1.events):
+            ev = self.class1.events[s_e]
+            olds_e = None
             if self.class2 is None or s_e not in self.class2.events:
+                olds_e = olduids.pop(self.uids[s_e], None)
+
+            if olds_e is not None:
+                # same event, at a new time
+                self.move(s_e, ev, olds_e)
+                moved.add(olds_e)
+                oldev = self.class2.events[olds_e]
+                fields = {'start': [olds_e[0].isoformat(), s_e[0].isoformat()],
+                    'end': [olds_e[1].isoformat(), s_e[1].isoformat()]}
+                for f in FEEDFIELDS:
+                    if (ev.get(f) or "") != (oldev.get(f) or ""):
+                        fields[f] = [oldev.get(f), ev.get(f)]
+                rec = self.screened('modify', s_e, fields)
+
+            elif self.class2 is None or s_e not in self.class2.events:
                 # class1 event is new
+                if not ev.get('uid'):
+                    self.uids[s_e] = free_uid(self.uids[s_e], taken)
+                    taken.add(self.uids[s_e])
                 self.add(s_e, ev)
+                fields = dict((f, [None, ev[f]]) for f in FEEDFIELDS if f in ev)
+                rec = self.screened('add', s_e, fields)
 
             else:
-                if ev.get('title') != self.class2.events[s_e].get('title'):
+                oldev = self.class2.events[s_e]
+                fields = {}
+
+                if ev.get('title') != oldev.get('title'):
                     self.modify(s_e, ev, 'title')
+                    fields['title'] = [oldev.get('title'), ev.get('title')]
 
-                if ev.get('venue') != self.class2.events[s_e].get('venue'):
+                if ev.get('venue') != oldev.get('venue'):
                     self.modify(s_e, ev, 'venue')
+                    fields['venue'] = [oldev.get('venue'), ev.get('venue')]
 
-                if ev.get('uni', "") != self.class2.events[s_e].get('uni', ""):
+                if ev.get('uni', "") != oldev.get('uni', ""):
                     self.modify(s_e, ev, 'uni')
+                    fields['uni'] = [oldev.get('uni', ""), ev.get('uni', "")]
 
-        pfmt = "%b %d, %Y at %I:%M%p"
+                rec = self.screened('modify', s_e, fields) if fields else None
+
+            if rec is not None:
+                yield rec
 
         if self.class2 is not None:
-            for s_e in sorted(self.class2.events):
-                if s_e not in self.class1.events:
+            for s_e in by_start(self.class2.events):
+                if s_e not in self.class1.events and s_e not in moved:
                     # print("dropping {}".format(s_e))
                     # event from class1 not in class2 - dropped (or moved?? or manually added to calendar)
-                    self.drop(s_e, self.class2.events[s_e])
+                    oldev = self.class2.events[s_e]
+                    if self.drop(s_e, oldev):
+                        fields = dict((f, [oldev[f], None]) for f in FEEDFIELDS if f in oldev)
+                        rec = self.screened('cancel', s_e, fields)
+                        if rec is not None:
+                            yield rec
+
+        elif self.state is not None:
+            # nothing to compare with but what was sent before - cancel what's gone since
+            for s_e, ev in sorted(self.state.cancels(self.class1.events, self.class1.fromdate, self.class1.todate).items()):
+                self.events[s_e] = ev
+                fields = dict((f, [ev[f], None]) for f in FEEDFIELDS if f in ev)
+                rec = self.screened('cancel', s_e, fields)
+                if rec is not None:
+                    yield rec
+
+    def comp_events(self, list_changes=True, feed=None, source=None):
+        ''' compare events. each change is written to feed, if given, as a line of json
+            as soon as it is found. source, if given, is added to each line.
+        '''
+
+        for rec in self.changes():
+            if source is not None:
+                rec['source'] = source
+            if feed is not None:
+                if feed is sys.stdout:
+                    # keep the detail lines in order with the feed's
+                    diag.flush()
+                # a slow reader blocks the write, which holds up the comparison
+                feed.write(json.dumps(rec, default=str) + "\n")
+                feed.flush()
+
+        diag.flush()
+
+        if self.state is not None and self.show_detail:
+            print("\n%d changes were already sent, per %s" % (self.ndrop, self.state.fn))
+
+        pfmt = "%b %d, %Y at %I:%M%p"
 
         if list_changes:
             # list the events to be changed
             print()
-            for s_e in sorted(self.events):
+            for s_e in by_start(self.events):
                 (evstrt, evend) = s_e
                 dt = evend - evstrt
                 ev = self.events[s_e]
@@ -211,6 +638,14 @@ class event_changes():
                 print("%s %s from %s to %s (%s)" % (act, self.events[s_e]['title'], evstrt.strftime(pfmt),
                     evend.strftime(pfmt), dt))
 
+    def xlsx_events(self, ofn=None):
+        ''' write a copy of the old (excel) workbook, with the changes made to it '''
+
+        if len(self.events) < 1:
+            return 0
+
+        return update_workbook(self.class2.infile, ofn, self.events, self.venue_addrs, self.class2.venue_addrs)
+
     def csv_events(self, ofn=None):
         if len(self.events) < 1:
             return 0 # if there aren't any changed events, we're done here
@@ -227,7 +662,7 @@ class event_changes():
         ocs.writeheader()
 
         nev = 0
-        for s_e in sorted(self.events):
+        for s_e in by_start(self.events):
             event = {}
 
             (evst, evend) = s_e
@@ -262,7 +697,7 @@ class event_changes():
                     if st == "WA":
                         st = "Washington"
                     elif len(st) < 4:
-                        print("WARNING: State abbreviations (except for WA) don't work!")
+                        diag.warn("state", "WARNING: State abbreviations (except for WA) don't work!")
                 else:
                     zipcode = ""
 
@@ -298,53 +733,33 @@ class event_changes():
     def list_events(self):
         # print("\nListing changed events")
 
-        lastmo = -1
-        for s_e in sorted(self.events):
-            (evst, evend) = s_e
-            if evst.month != lastmo:
-                lastmo = evst.month
-                print("\n{:%B %Y}".format(evst))
-
-            ev = self.events[s_e]
-            typ = ev.get('type', "")
-            uni = ev.get('uni', "")
+        for mo, keys in by_month(self.events):
+            print("\n{:%B %Y}".format(keys[0][0]))
 
-            if typ == "absences":
-                # sts = evst.strftime("%m/%d/%Y")
-                # ends = evend.strftime("%m/%d/%Y")
-                sts = "{:%d}".format(evst)
-                ends = "{:%d}".format(evend)
+            for s_e in keys:
+                (evst, evend) = s_e
+                ev = self.events[s_e]
+                typ = ev.get('type', "")
+                uni = ev.get('uni', "")
 
-                print("%s"  % (ev['title']))
-                print("  from %s to %s"  % (sts, ends))
-            else:
-                ven = ev['venue']
+                if typ == "absences":
+                    # sts = evst.strftime("%m/%d/%Y")
+                    # ends = evend.strftime("%m/%d/%Y")
+                    sts = "{:%d}".format(evst)
+                    ends = "{:%d}".format(evend)
 
-                if evend.day == evst.day:
-                    times = "\n  {:%d (%a), %I:%M %p} - {:%I:%M %p}".format(evst, evend)
+                    print("%s"  % (ev['title']))
+                    print("  from %s to %s"  % (sts, ends))
                 else:
-                    times = "\n  {:%d (%a) %I:%M %p} - {:%d (%a) at %I:%M %p}".format(evst, evend)
+                    ven = ev['venue']
 
-                print("  {}".format(times))
+                    times = "\n  " + event_times(evst, evend)
 
-                if ev['title'] == ven:
-                    evnam = ven
-                elif 'Rehearsal' in ev['title'] and ven == "Lewis & Clark Evt Ctr":
-                    evnam = ev['title']
-                elif ev['title'] == 'Board Meeting' and ven == "Lewis & Clark Evt Ctr":
-                    evnam = ev['title']
-                else:
-                    evnam = "{} at {}".format(ev['title'], ven)
+                    print("  {}".format(times))
 
-                if uni and uni != "" and uni != "- none -":
-                    if uni == "singout":
-                        evnam = "{}, UNIFORM: black shirt, blue tie".format(evnam)
-                    elif uni == "contest":
-                        evnam = "{}, UNIFORM: black shirt, blue tie, blue vest".format(evnam)
-                    else:
-                        evnam = "{}, UNIFORM: {}".format(evnam, uni)
+                    evnam = event_label(ev['title'], ven, uni)
 
-                print("    {}".format(evnam))
+                    print("    {}".format(evnam))
 
     def event_list_pdf(self, pdffn=None):
         def pdfbold(txt, tcolor, keep):
@@ -417,7 +832,7 @@ class event_changes():
         tz = pytz.timezone("US/Pacific")
         midnite = datetime.now().replace(hour=23, minute=59, second=59, microsecond=999999, tzinfo=tz)
 
-        for s_e in sorted(self.events):
+        for s_e in by_start(self.events):
             (evst, evend) = s_e
 
             if evend < midnite:
@@ -456,29 +871,11 @@ class event_changes():
                 ven = ev['venue'].strip()
 
                 self.pdfy += self.pdfdy
-                if evend.day == evst.day:
-                    times = "{:%d (%a), %I:%M %p} - {:%I:%M %p}".format(evst, evend)
-                else:
-                    times = "{:%d (%a) %I:%M %p} - {:%d (%a) at %I:%M %p}".format(evst, evend)
+                times = event_times(evst, evend)
 
                 pdfout("{}".format(times), tcolor, 3, 3)
 
-                if ev['title'] == ven:
-                    evnam = ven
-                elif 'Rehearsal' in ev['title'] and ven == "Lewis & Clark Evt Ctr":
-                    evnam = ev['title']
-                elif ev['title'] == 'Board Meeting' and ven == "Lewis & Clark Evt Ctr":
-                    evnam = ev['title']
-                else:
-                    evnam = "{} at {}".format(ev['title'], ven)
-
-                if uni and uni != "" and uni != "- none -":
-                    if uni == "singout":
-                        evnam = "{}, UNIFORM: black shirt, blue tie".format(evnam)
-                    elif uni == "contest":
-                        evnam = "{}, UNIFORM: black shirt, blue tie, blue vest".format(evnam)
-                    else:
-                        evnam = "{}, UNIFORM: {}".format(evnam, uni)
+                evnam = event_label(ev['title'], ven, uni)
 
                 pdfout(evnam, tcolor, 2, 5)
 
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+'''
+    events, keyed by (start, end), kept in order.
+
+    an event_map is a dict - the events of tuner_events and event_changes - that
+    also keeps its keys in a sorted list. a key is put in its place by bisection as
+    it's added (at the end, for events read in date order), so the events are
+    always in order without sorting them again, and the ones in a date range are
+    found by bisection too.
+
+        for s_e in events.ordered(): ...                  # same as sorted(events)
+        for s_e in events.range(fromdate, todate): ...    # the ones in the range
+        for (yr, mo), keys in events.months(): ...
+'''
+
+from bisect import bisect_left, bisect_right, insort
+from datetime import timedelta
+from itertools import groupby
+
+class event_map(dict):
+
+    def __init__(self, *args, **kw):
+        dict.__init__(self)
+        self.order = []
+        # the longest event - none starts further before a range than this and reaches into it
+        self.longest = timedelta(0)
+        self.update(*args, **kw)
+
+    def __reduce__(self):
+        # pickled (for a loader process) as a plain dict, and put back in order
+        return (event_map, (dict(self),))
+
+    def __setitem__(self, s_e, ev):
+        if s_e not in self:
+            if not self.order or s_e > self.order[-1]:
+                self.order.append(s_e)
+            else:
+                insort(self.order, s_e)
+            self.longest = max(self.longest, s_e[1] - s_e[0])
+        dict.__setitem__(self, s_e, ev)
+
+    def __delitem__(self, s_e):
+        dict.__delitem__(self, s_e)
+        del self.order[bisect_left(self.order, s_e)]
+
+    def update(self, *args, **kw):
+        for s_e, ev in dict(*args, **kw).items():
+            self[s_e] = ev
+
+    def setdefault(self, s_e, ev=None):
+        if s_e not in self:
+            self[s_e] = ev
+        return self[s_e]
+
+    def pop(self, s_e, *default):
+        if s_e not in self:
+            return dict.pop(self, s_e, *default)
+        ev = self[s_e]
+        del self[s_e]
+        return ev
+
+    def popitem(self):
+        s_e = self.order[-1]
+        return s_e, self.pop(s_e)
+
+    def clear(self):
+        dict.clear(self)
+        self.order = []
+        self.longest = timedelta(0)
+
+    def copy(self):
+        return event_map(self)
+
+    def ordered(self):
+        ''' the keys, by start (then end) time '''
+
+        return list(self.order)
+
+    def range(self, fromdate=None, todate=None):
+        ''' the keys, in order, of the events on or between fromdate and todate - that
+            end on or after fromdate and start on or before todate. None is no limit.
+        '''
+
+        lo = 0 if fromdate is None else bisect_left(self.order, (fromdate - self.longest,))
+        hi = len(self.order) if todate is None else bisect_right(self.order, (todate, todate + self.longest))
+        return [s_e for s_e in self.order[lo:hi] if fromdate is None or s_e[1] >= fromdate]
+
+    def months(self, fromdate=None, todate=None):
+        ''' ((year, month), [keys]) for each month the events (in the range) start in, in order '''
+
+        for mo, keys in groupby(self.range(fromdate, todate), key=lambda s_e: (s_e[0].year, s_e[0].month)):
+            yield mo, list(keys)
+
+def by_start(events):
+    ''' the keys of events - an event_map or a plain dict - by start time '''
+
+    if isinstance(events, event_map):
+        return events.ordered()
+    return sorted(events)
+
+def by_month(events):
+    ''' ((year, month), [keys]) for each month the events - an event_map or a plain dict - start in '''
+
+    if isinstance(events, event_map):
+        return events.months()
+    return ((mo, list(keys)) for mo, keys in groupby(sorted(events), key=lambda s_e: (s_e[0].year, s_e[0].month)))
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+'''
+    the events, for other programs to use without running perfcal.py.
+
+    nothing here prints or exits. the messages made while loading or comparing
+    (overlaps, unknown venues...) are kept with the result, in .messages, as
+    [(level, category, message)] - see diag. a program that keeps running can load
+    its files once and ask as many questions of them as it likes.
+
+        import event_set
+        cur = event_set.load("SingoutInfo.xlsx", fromdate=date(2023, 7, 1), todate=date(2023, 12, 31))
+        for s_e, ev in cur.query(types="p", venue="Country Cousin"):
+            ...
+        old = event_set.load("tuners2023.ics", fromdate=cur.fromdate, todate=cur.todate)
+        for rec in event_set.diff(cur, old):
+            ...     # {'action': , 'key': , 'uid': , 'fields': } as in --feed
+        chg = event_set.changes(cur, old)
+        event_set.write(chg, "events2023.ics")
+'''
+
+from datetime import datetime, date, time
+import pytz
+
+import diag
+from tuner_events import tuner_events, event_kind
+from event_changes import event_changes
+from event_map import event_map
+
+TYPES = "abpr"
+
+pst = pytz.timezone("US/Pacific")
+
+def when(d, end=False):
+    ''' d (a date, or a datetime with or without a timezone) as a pacific time datetime.
+        a date is its first second, or with end, its last.
+    '''
+
+    if not isinstance(d, datetime):
+        d = datetime.combine(d, time(23, 59, 59) if end else time(0, 0))
+    if d.tzinfo is None:
+        return pst.localize(d)
+    return d.astimezone(pst)
+
+def type_flags(types):
+    ''' {'a': , 'b': , 'p': , 'r': } - the dotypes of tuner_events - for a string of those letters '''
+
+    bad = set(types) - set(TYPES)
+    if bad:
+        raise ValueError("unknown event types %s - use some of %s" % ("".join(sorted(bad)), TYPES))
+    return dict((t, t in types) for t in TYPES)
+
+class event_set():
+    ''' a set of loaded events (a tuner_events, in .source), in order of start time '''
+
+    def __init__(self, source, messages=None):
+        if not isinstance(source.events, event_map):
+            source.events = event_map(source.events)
+        self.source = source
+        self.events = source.events
+        self.fromdate = source.fromdate
+        self.todate = source.todate
+        self.venue_addrs = source.venue_addrs
+        self.messages = messages or []
+
+    def __len__(self):
+        return len(self.events)
+
+    def __iter__(self):
+        ''' (s_e, event) for each event, by start time '''
+
+        for s_e in self.events.ordered():
+            yield s_e, self.events[s_e]
+
+    def range(self, fromdate=None, todate=None):
+        ''' (s_e, event) for each event on or between fromdate and todate '''
+
+        fromdate = None if fromdate is None else when(fromdate)
+        todate = None if todate is None else when(todate, end=True)
+        for s_e in self.events.range(fromdate, todate):
+            yield s_e, self.events[s_e]
+
+    def query(self, fromdate=None, todate=None, types=None, venue=None):
+        ''' (s_e, event) for each event on or between fromdate and todate, of one of types
+            (a string of a, b, p, r - as perfcal's -a, -b, -p, -r), at venue. None is any.
+        '''
+
+        if types is not None:
+            type_flags(types)
+        if venue is not None:
+            venue = venue.strip().lower()
+
+        for s_e, ev in self.range(fromdate, todate):
+            if types is not None and event_kind(ev) not in types:
+                continue
+            if venue is not None and (ev.get('venue') or "").strip().lower() != venue:
+                continue
+            yield s_e, ev
+
+    def venues(self):
+        ''' {venue: (address 1, address 2)} of the venues the events are at '''
+
+        return dict((ven, self.venue_addrs[ven]) for ven in set(ev.get('venue') for ev in self.events.values())
+            if ven in self.venue_addrs)
+
+    def subset(self, types=TYPES, fromdate=None, todate=None):
+        ''' another event_set, of just the events of types from fromdate through todate '''
+
+        fromdate = self.fromdate if fromdate is None else when(fromdate)
+        todate = self.todate if todate is None else when(todate, end=True)
+        return event_set(self.source.subset(type_flags(types), fromdate, todate))
+
+def load(path, types=TYPES, fromdate=None, todate=None, calnames=None):
+    ''' an event_set of the events in path (a workbook, .ics, .zip export or .evs snapshot),
+        of types, from fromdate through todate - this year, if not given. calnames picks
+        the calendars of a .zip, as perfcal's -s does.
+    '''
+
+    year = datetime.now().year
+    fromdate = when(fromdate or date(year, 1, 1))
+    todate = when(todate or date(year, 12, 31), end=True)
+    caln = None if ".xls" in path else calnames
+
+    diag.capture()
+    try:
+        evs = tuner_events(path, type_flags(types), caln, fromdate=fromdate, todate=todate)
+    finally:
+        messages = diag.release()
+    return event_set(evs, messages)
+
+def changes(cur, old=None, rrules=False, state=None):
+    ''' an event_changes of what's to change to make old (an event_set, or None) like cur.
+        its .events has the changes, and .messages what was said about them.
+    '''
+
+    chg = event_changes([cur.source, old.source if old is not None else None], show_detail=False,
+        rrules=rrules, state=state)
+    chg.records = []
+    diag.capture()
+    try:
+        for rec in chg.changes():
+            chg.records.append(rec)
+    finally:
+        chg.messages = diag.release()
+    return chg
+
+def diff(cur, old=None, state=None):
+    ''' the change records - {'action': , 'key': [start, end], 'uid': , 'fields': } - of
+        what's to change to make old like cur
+    '''
+
+    return changes(cur, old, state=state).records
+
+def write(chg, ofn):
+    ''' write the changes of an event_changes from changes() to ofn, as .ics, .csv or .xlsx
+        by its extension. returns how many events were written.
+    '''
+
+    diag.capture()
+    try:
+        return chg.write_events(ofn)
+    finally:
+        chg.messages += diag.release()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+'''
+    static web site of events: a page per month, an index of the months and an
+    .ics file of all the events, for download.
+
+    site.json in the site directory keeps a hash of what went into each month's
+    page. a month is only rendered again when its events (or whether they are
+    past) have changed, so after a one event edit only that month's page, the
+    index and the .ics file are written. the .ics file has more of each event than
+    the pages show, so it has a hash of its own, of all the events' fields and
+    their venues' addresses.
+'''
+
+import os
+import json
+from html import escape
+from hashlib import sha1
+from datetime import datetime
+import pytz
+
+from event_changes import event_label, event_times
+from event_map import by_start
+
+MANIFEST = "site.json"
+ICSNAME = "tuners.ics"
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>%(title)s</title>
+<style>
+  .past { color: slategray; }
+  .cancelled { color: crimson; }
+  .past.cancelled { color: lightpink; }
+  dd { margin-bottom: 0.5em; }
+</style>
+</head>
+<body>
+<h1>%(title)s</h1>
+%(body)s
+</body>
+</html>
+"""
+
+def month_name(month):
+    return datetime.strptime(month, "%Y-%m").strftime("%B %Y")
+
+def month_entries(events, midnite):
+    ''' {"yyyy-mm": [(when, what, css class)]} for events ({s_e: event}), in order '''
+
+    months = {}
+    for s_e in by_start(events):
+        (evst, evend) = s_e
+        ev = events[s_e]
+        typ = ev.get('type', "")
+
+        cls = []
+        if evend < midnite:
+            cls.append("past")
+        if 'cancelled' in ev['title'].lower():
+            cls.append("cancelled")
+
+        if typ == "absences":
+            when = "{:%d (%a)} - {:%d (%a)}".format(evst, evend)
+            what = ev['title']
+        else:
+            when = event_times(evst, evend)
+            what = event_label(ev['title'], ev['venue'].strip(), ev.get('uni', ""))
+
+        months.setdefault("{:%Y-%m}".format(evst), []).append((when, what, " ".join(cls)))
+    return months
+
+def month_page(month, entries):
+    body = []
+    if entries:
+        body.append("<dl>")
+        for when, what, cls in entries:
+            attr = ' class="%s"' % (cls) if cls else ""
+            body.append("<dt%s>%s</dt><dd%s>%s</dd>" % (attr, escape(when), attr, escape(what)))
+        body.append("</dl>")
+    else:
+        body.append("<p>No events.</p>")
+    body.append('<p><a href="index.html">All months</a> - <a href="%s">calendar (.ics)</a></p>' % (ICSNAME))
+    return PAGE % {'title': escape("Tuners - " + month_name(month)), 'body': "\n".join(body)}
+
+def index_page(counts):
+    body = ["<ul>"]
+    for month in sorted(counts):
+        body.append('<li><a href="%s.html">%s</a> (%d)</li>' % (month, escape(month_name(month)), counts[month]))
+    body.append("</ul>")
+    body.append('<p><a href="%s">Download the calendar (.ics)</a></p>' % (ICSNAME))
+    return PAGE % {'title': "Tuners Events", 'body': "\n".join(body)}
+
+def write_site(evchanges, sitedir, fromdate, todate):
+    ''' write (or bring up to date) the site in sitedir for the events of evchanges,
+        an event_changes listing events from fromdate through todate. months outside
+        that range are left as they are. returns the number of pages written.
+    '''
+
+    os.makedirs(sitedir, exist_ok=True)
+    mfn = os.path.join(sitedir, MANIFEST)
+    manifest = {'months': {}}
+    if os.path.exists(mfn):
+        with open(mfn, "r") as fo:
+            manifest = json.load(fo)
+
+    tz = pytz.timezone("US/Pacific")
+    midnite = datetime.now(tz).replace(hour=23, minute=59, second=59, microsecond=999999)
+    months = month_entries(evchanges.events, midnite)
+
+    # every month in the range has a page, even with no events
+    mo = fromdate.year * 12 + fromdate.month - 1
+    while mo <= todate.year * 12 + todate.month - 1:
+        months.setdefault("%d-%02d" % (mo // 12, mo % 12 + 1), [])
+        mo += 1
+
+    # everything cal_events writes, whether or not a page shows it - the events'
+    # fields and the addresses of their venues
+    evlist = [[s_e[0].isoformat(), s_e[1].isoformat(), evchanges.events[s_e]] for s_e in by_start(evchanges.events)]
+    venues = set(ev.get('venue') for ev in evchanges.events.values())
+    addrs = sorted([ven, list(addr)] for ven, addr in evchanges.venue_addrs.items() if ven in venues)
+    icshash = sha1(json.dumps([evlist, addrs], sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    icsfn = os.path.join(sitedir, ICSNAME)
+
+    npages = 0
+    for month, entries in sorted(months.items()):
+        digest = sha1(json.dumps(entries).encode('utf-8')).hexdigest()
+        pfn = os.path.join(sitedir, month + ".html")
+        old = manifest['months'].get(month)
+        if old is not None and old['hash'] == digest and os.path.exists(pfn):
+            continue
+
+        with open(pfn, "w") as fo:
+            fo.write(month_page(month, entries))
+        manifest['months'][month] = {'hash': digest, 'events': len(entries)}
+        print("wrote %s" % (pfn))
+        npages += 1
+
+    written = os.path.exists(os.path.join(sitedir, "index.html")) and os.path.exists(icsfn)
+    if npages == 0 and manifest.get('ics') == icshash and written:
+        print("%s is up to date" % (sitedir))
+        return 0
+
+    counts = dict((month, m['events']) for month, m in manifest['months'].items())
+    with open(os.path.join(sitedir, "index.html"), "w") as fo:
+        fo.write(index_page(counts))
+
+    evchanges.cal_events(icsfn)
+    manifest['ics'] = icshash
+
+    tmpfn = mfn + ".tmp"
+    with open(tmpfn, "w") as fo:
+        json.dump(manifest, fo, indent=1, sort_keys=True)
+    os.replace(tmpfn, mfn)
+
+    return npages + 1
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+'''
+    compact binary snapshots of a loaded tuner_events set.
+
+    A snapshot holds events, venue_addrs and calfiles, so the "old" side of a
+    comparison can be reloaded without re-parsing the Google export.
+
+    layout (little endian, every section starts on an 8 byte boundary):
+        header      - magic, format version, counts, date range covered
+        strings     - uint32 offsets (nstrings + 1), then one utf-8 blob.
+                      every string in the snapshot is stored once and
+                      referred to by its index.
+        fields      - int32 string index of each event field name
+        starts      - int64 epoch seconds, one per event
+        ends        - int64 epoch seconds, one per event
+        columns     - one int32 column per field, string index per event
+                      (-1 => None, -2 => field not present in the event)
+        kinds       - one int8 column per field, the type of each value,
+                      which is stored as a string (see KINDS)
+        venues      - int32 venue name, kind (0 tuple, 1 list), first, count
+        addrs       - int32 string index of each venue address line
+        calfiles    - int32 calendar name, member name; int64 event count
+
+    The file is read through mmap, and the numeric sections are used in place
+    as memoryviews, so loading costs one pass over the events in range.
+'''
+
+import sys
+import struct
+import mmap
+from array import array
+from datetime import datetime, date
+from event_map import by_start
+
+MAGIC = b"PCEVSNAP"
+VERSION = 2
+
+# magic, version, pad, fromdate, todate, source, infile,
+# nstrings, nblob, nfields, nevents, nvenues, naddrs, ncalfiles
+HEADER = struct.Struct("<8sHHqqiiIQIIIII")
+
+NONE = -1
+ABSENT = -2
+
+# value types, by kind. anything else is kept as its str()
+STR, DATETIME, DATE, INT, FLOAT, BOOL = range(6)
+KINDS = [(DATETIME, datetime), (DATE, date), (BOOL, bool), (INT, int), (FLOAT, float)]
+
+def _kind(v):
+    for kind, typ in KINDS:
+        if isinstance(v, typ):
+            return kind
+    return STR
+
+def _text(kind, v):
+    if kind in (DATETIME, DATE):
+        return v.isoformat()
+    if kind == BOOL:
+        return "1" if v else ""
+    return repr(v) if kind == FLOAT else str(v)
+
+def _value(kind, text, tz):
+    if kind == DATETIME:
+        dt = datetime.fromisoformat(text)
+        return dt.astimezone(tz) if dt.tzinfo is not None else dt
+    elif kind == DATE:
+        return date.fromisoformat(text)
+    elif kind == INT:
+        return int(text)
+    elif kind == FLOAT:
+        return float(text)
+    elif kind == BOOL:
+        return text != ""
+    return text
+
+def _align(n):
+    return (n + 7) & ~7
+
+def _pad(fo, n):
+    extra = _align(n) - n
+    if extra:
+        fo.write(b"\0" * extra)
+    return n + extra
+
+class _strtab():
+    ''' intern strings as they are added, handing back an index for each '''
+
+    def __init__(self):
+        self.index = {}
+        self.strs = []
+
+    def add(self, s):
+        if s is None:
+            return NONE
+        s = str(s)
+        ndx = self.index.get(s)
+        if ndx is None:
+            ndx = len(self.strs)
+            self.index[s] = ndx
+            self.strs.append(s)
+        return ndx
+
+def write_snapshot(evset, fn):
+    ''' write the events, venue_addrs and calfiles of evset to snapshot file fn '''
+
+    strs = _strtab()
+
+    # use every field name that appears in any event, in a stable order
+    fields = []
+    for ev in evset.events.values():
+        for k in ev:
+            if k not in fields:
+                fields.append(k)
+
+    keys = by_start(evset.events)
+    starts = array('q', [int(s.timestamp()) for (s, e) in keys])
+    ends = array('q', [int(e.timestamp()) for (s, e) in keys])
+
+    columns = []
+    kinds = []
+    for fld in fields:
+        col = array('i')
+        kcol = array('b')
+        for s_e in keys:
+            ev = evset.events[s_e]
+            kind = STR
+            if fld not in ev:
+                col.append(ABSENT)
+            elif ev[fld] is None:
+                col.append(NONE)
+            else:
+                kind = _kind(ev[fld])
+                col.append(strs.add(_text(kind, ev[fld])))
+            kcol.append(kind)
+        columns.append(col)
+        kinds.append(kcol)
+
+    venues = array('i')
+    addrs = array('i')
+    for ven, addr in evset.venue_addrs.items():
+        kind = 1 if isinstance(addr, list) else 0
+        venues.extend([strs.add(ven), kind, len(addrs), len(addr)])
+        addrs.extend([strs.add(a) for a in addr])
+
+    calfiles = getattr(evset, "calfiles", {})
+    calnames = array('i')
+    calcounts = array('q')
+    for cal, (mem, nev) in calfiles.items():
+        calnames.extend([strs.add(cal), strs.add(mem)])
+        calcounts.append(nev)
+
+    fieldndx = array('i', [strs.add(f) for f in fields])
+    source = strs.add(evset.event_source)
+    infile = strs.add(evset.infile)
+
+    blob = bytearray()
+    offsets = array('I', [0])
+    for s in strs.strs:
+        blob += s.encode('utf-8')
+        offsets.append(len(blob))
+
+    hdr = HEADER.pack(MAGIC, VERSION, 0, int(evset.fromdate.timestamp()), int(evset.todate.timestamp()),
+        source, infile, len(strs.strs), len(blob), len(fields), len(keys), len(evset.venue_addrs),
+        len(addrs), len(calfiles))
+
+    with open(fn, "wb") as fo:
+        pos = _pad(fo, fo.write(hdr))
+        for sect in [offsets, blob, fieldndx, starts, ends] + columns + kinds + [venues, addrs, calnames, calcounts]:
+            pos = _pad(fo, pos + fo.write(sect))
+
+    return len(keys)
+
+class snapshot():
+    ''' read only, memory mapped view of a snapshot file '''
+
+    def __init__(self, fn):
+        self.fn = fn
+        with open(fn, "rb") as fo:
+            self.mm = mmap.mmap(fo.fileno(), 0, access=mmap.ACCESS_READ)
+
+        mv = memoryview(self.mm)
+        self.views = [mv]
+        (magic, version, _, fromts, tots, source, infile, nstrings, nblob, nfields, nevents,
+            nvenues, naddrs, ncalfiles) = HEADER.unpack_from(mv)
+
+        if magic != MAGIC:
+            raise ValueError("%s is not a perfcal snapshot" % (fn))
+        if version != VERSION:
+            raise ValueError("%s is snapshot version %d, expected %d" % (fn, version, VERSION))
+
+        self.nevents = nevents
+        pos = _align(HEADER.size)
+
+        def section(code, count, size):
+            nonlocal pos
+            sect = mv[pos:pos + count * size]
+            self.views.append(sect)
+            sect = sect.cast(code)
+            self.views.append(sect)
+            pos = _align(pos + count * size)
+            return sect
+
+        offsets = section('I', nstrings + 1, 4)
+        blob = section('B', nblob, 1)
+        self.strs = [sys.intern(str(blob[offsets[i]:offsets[i+1]], 'utf-8')) for i in range(nstrings)]
+
+        self.fields = [self.strs[i] for i in section('i', nfields, 4)]
+        self.starts = section('q', nevents, 8)
+        self.ends = section('q', nevents, 8)
+        self.columns = [section('i', nevents, 4) for f in self.fields]
+        self.kinds = [section('b', nevents, 1) for f in self.fields]
+        self.venues = section('i', nvenues * 4, 4)
+        self.addrs = section('i', naddrs, 4)
+        self.calnames = section('i', ncalfiles * 2, 4)
+        self.calcounts = section('q', ncalfiles, 8)
+
+        self.fromts = fromts
+        self.tots = tots
+        self.source = self.str(source)
+        self.infile = self.str(infile)
+
+    def str(self, ndx):
+        return None if ndx < 0 else self.strs[ndx]
+
+    def venue_addrs(self):
+        va = {}
+        for i in range(0, len(self.venues), 4):
+            ven, kind, first, count = self.venues[i:i+4]
+            addr = [self.str(a) for a in self.addrs[first:first + count]]
+            va[self.str(ven)] = addr if kind == 1 else tuple(addr)
+        return va
+
+    def calfiles(self):
+        cf = {}
+        for i in range(len(self.calcounts)):
+            cf[self.str(self.calnames[2*i])] = [self.str(self.calnames[2*i+1]), self.calcounts[i]]
+        return cf
+
+    def events(self, tz, fromdate, todate):
+        ''' yield (s_e, event) for the events which are in fromdate - todate '''
+
+        fromts = int(fromdate.timestamp())
+        tots = int(todate.timestamp())
+
+        for i in range(self.nevents):
+            if self.ends[i] < fromts or self.starts[i] > tots:
+                continue
+
+            ev = {}
+            for fld, col, kcol in zip(self.fields, self.columns, self.kinds):
+                ndx = col[i]
+                if ndx == ABSENT:
+                    continue
+                ev[fld] = None if ndx == NONE else _value(kcol[i], self.strs[ndx], tz)
+
+            s_e = (datetime.fromtimestamp(self.starts[i], tz), datetime.fromtimestamp(self.ends[i], tz))
+            yield s_e, ev
+
+    def close(self):
+        # views must be released before the map can be closed
+        for v in reversed(self.views):
+            v.release()
+        self.mm.close()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+'''
+    find open dates for booking a performance.
+
+    the loaded events are indexed once: bookings sorted by start with a running
+    maximum of their end times, and absences merged into sorted, disjoint ranges.
+    each candidate slot is then checked with a couple of binary searches.
+'''
+
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+from tuner_events import event_kind, event_end
+from event_map import by_start
+
+DAYNAMES = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+class occupancy():
+
+    def __init__(self, events):
+        busy = [s_e for s_e in by_start(events) if event_kind(events[s_e]) != 'a']
+        # absences as they really are, without the day added for google
+        away = sorted((s_e[0], event_end(s_e, events[s_e])) for s_e in by_start(events) if event_kind(events[s_e]) == 'a')
+
+        # maxend[i] is the latest end of bookings 0..i, so "does anything starting
+        # before t end after u" is one lookup.
+        self.starts = [st for (st, end) in busy]
+        self.maxend = []
+        latest = None
+        for (st, end) in busy:
+            latest = end if latest is None or end > latest else latest
+            self.maxend.append(latest)
+
+        # absences overlap each other (several members away at once) - merge them
+        merged = []
+        for (st, end) in away:
+            if merged and st <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([st, end])
+        self.away_starts = [st for (st, end) in merged]
+        self.away_ends = [end for (st, end) in merged]
+
+    def booked(self, st, end, gap=timedelta(0)):
+        ''' is any booking within gap of st - end? '''
+        i = bisect_left(self.starts, end + gap)
+        return i > 0 and self.maxend[i - 1] > st - gap
+
+    def away(self, st, end):
+        ''' does st - end overlap any absence? '''
+        i = bisect_right(self.away_starts, end)
+        # ranges are disjoint, so only the last one starting before end can reach st
+        return i > 0 and self.away_ends[i - 1] > st
+
+def parse_slots(spec):
+    ''' "thu,tue@18:30-19:15" => ([3, 1], time(18, 30), time(19, 15)) '''
+
+    try:
+        days, times = spec.lower().split("@")
+        dows = [DAYNAMES.index(d.strip()[:3]) for d in days.split(",")]
+        t1, t2 = [datetime.strptime(t.strip(), "%H:%M").time() for t in times.split("-")]
+    except ValueError:
+        raise UserWarning("invalid slot spec ({}), expected e.g. thu@18:30-19:15".format(spec))
+
+    if t2 <= t1:
+        raise UserWarning("slot in {} ends before it starts".format(spec))
+
+    return dows, t1, t2
+
+def open_slots(evset, spec, gap=timedelta(0)):
+    ''' yield (start, end) of the slots given by spec, in evset's date range, that are
+        at least gap from any booking and overlap no absence.
+    '''
+
+    dows, t1, t2 = parse_slots(spec)
+    occ = occupancy(evset.events)
+
+    day = evset.fromdate.date()
+    while day <= evset.todate.date():
+        if day.weekday() in dows:
+            st = evset.pst.localize(datetime.combine(day, t1))
+            end = evset.pst.localize(datetime.combine(day, t2))
+            if st >= evset.fromdate and end <= evset.todate:
+                if not occ.booked(st, end, gap) and not occ.away(st, end):
+                    yield st, end
+        day += timedelta(days=1)
+
+def slot_report(evset, spec, gap=timedelta(0)):
+    print("\nOpen slots for %s, at least %s from other events, with no absences:" % (spec, gap))
+
+    nslot = 0
+    for st, end in open_slots(evset, spec, gap):
+        print("  {:%a %m/%d/%Y %I:%M %p} - {:%I:%M %p}".format(st, end))
+        nslot += 1
+
+    print("%d open slots" % (nslot))
+    return nslot
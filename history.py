@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+'''
+    history of calendar exports and update files.
+
+    instead of keeping each export (or throwing the last one away when the new one
+    is renamed over it), the VEVENT blocks of each file are kept in a store, once
+    each, named by the sha1 of their contents. an event that didn't change between
+    exports takes no more room. DTSTAMP is left out of the blocks, since every
+    export stamps every event again.
+
+    each file added is a run, in runs.jsonl: when, which file, and for each calendar
+    in it the map of its events (uid => block) and what changed since the previous
+    export of that calendar. the maps are stored like the blocks, so an unchanged
+    calendar's map is only kept once.
+
+    an export is one calendar (.ics), or several in a google .zip. calendars are known
+    by their X-WR-CALNAME, so the same calendar matches in either. files whose names
+    start with "events" are taken to be update files written by perfcal; they are
+    kept, but don't change the state of the calendar.
+'''
+
+import os, sys
+import json
+import zlib
+import getopt
+from hashlib import sha1
+from datetime import datetime, timedelta, timezone
+from zipfile import ZipFile
+import pytz
+
+RUNS = "runs.jsonl"
+
+def usage(msg="", error=0):
+    if msg != "":
+        print("\n>>> %s\n" % (msg))
+
+    print("""Usage: %s [-h] [-d dir] command ...
+   where:
+      -h    show this help and exit
+      -d dir => history store. default - .history
+
+   commands:
+      add [-u] file...  => add exports (.ics, or google .zip) and update files to the
+                history. -u - they are update files (default for events*.ics).
+      log   => list the runs, with how many events each added, changed and removed
+                (or for an update file, sent)
+      state [-o file] date => the calendars as of date (yyyy-mm-dd, or yyyy-mm-ddThh:mm),
+                from the last export before then. -o writes them to file (.ics, or
+                .zip for more than one calendar).
+      blame text => every run that added, changed, removed or sent an event whose uid
+                or summary contains text
+""" % (sys.argv[0]))
+
+    sys.exit(error)
+
+def unfold(lines):
+    ''' ics content lines, with continuation lines joined '''
+
+    out = []
+    for line in lines:
+        if line[:1] in (" ", "\t") and out:
+            out[-1] += line[1:]
+        else:
+            out.append(line)
+    return out
+
+def prop(line):
+    ''' name of the property on an unfolded content line, and its value '''
+
+    name, _, value = line.partition(":")
+    return name.split(";")[0].upper(), value
+
+def split_cal(data):
+    ''' split one calendar into its header (everything but the events) and its events.
+        returns (calendar name, header, {key: block}). key is the uid, plus the
+        recurrence-id for one instance of a series.
+    '''
+
+    lines = data.decode('utf-8').splitlines()
+    header = []
+    events = {}
+    calname = None
+    block = None
+    for line in lines:
+        if block is not None:
+            if line[:1] in (" ", "\t") and skipping:
+                continue
+            skipping = line.upper().startswith("DTSTAMP")
+            if not skipping:
+                block.append(line)
+            if line.upper() == "END:VEVENT":
+                flds = dict(prop(ln) for ln in unfold(block))
+                key = flds.get('UID', "")
+                if 'RECURRENCE-ID' in flds:
+                    key += "|" + flds['RECURRENCE-ID']
+                n = 1
+                while key in events:
+                    # same uid twice in one file. keep both.
+                    n += 1
+                    key = "%s#%d" % (key.split("#")[0], n)
+                events[key] = "\r\n".join(block) + "\r\n"
+                block = None
+        elif line.upper() == "BEGIN:VEVENT":
+            block = [line]
+            skipping = False
+        elif line.upper() != "END:VCALENDAR":
+            header.append(line)
+            if line.upper().startswith("X-WR-CALNAME:"):
+                calname = line.split(":", 1)[1]
+
+    return calname, "\r\n".join(header) + "\r\n", events
+
+def block_label(block):
+    ''' summary and start of an event block, for blame '''
+
+    flds = dict(prop(ln) for ln in unfold(block.splitlines()))
+    return "%s %s" % (flds.get('DTSTART', "?"), flds.get('SUMMARY', "?"))
+
+class history():
+
+    def __init__(self, dirn):
+        self.dirn = dirn
+        self.runs = []
+
+        fn = os.path.join(dirn, RUNS)
+        if os.path.exists(fn):
+            with open(fn, "r") as fo:
+                self.runs = [json.loads(line) for line in fo if line.strip()]
+
+    def put(self, text):
+        ''' store text, if it isn't already. returns its name '''
+
+        h = sha1(text.encode('utf-8')).hexdigest()
+        fn = os.path.join(self.dirn, "objects", h[:2], h[2:])
+        if not os.path.exists(fn):
+            os.makedirs(os.path.dirname(fn), exist_ok=True)
+            tmpfn = fn + ".tmp"
+            with open(tmpfn, "wb") as fo:
+                fo.write(zlib.compress(text.encode('utf-8'), 9))
+            os.replace(tmpfn, fn)
+        return h
+
+    def get(self, h):
+        with open(os.path.join(self.dirn, "objects", h[:2], h[2:]), "rb") as fo:
+            return zlib.decompress(fo.read()).decode('utf-8')
+
+    def calmap(self, h):
+        return json.loads(self.get(h))
+
+    def last_export(self, cal, when):
+        ''' the last export of cal at or before when (utc iso time), or None '''
+
+        last = None
+        for run in self.runs:
+            if run['kind'] == "export" and cal in run['cals'] and run['time'] <= when:
+                if last is None or run['time'] >= last['time']:
+                    last = run
+        return last
+
+    def add(self, fn, kind=None):
+        ''' add an export or update file. returns the run, or None if it was already added '''
+
+        with open(fn, "rb") as fo:
+            data = fo.read()
+        digest = sha1(data).hexdigest()
+        for run in self.runs:
+            if run['sha'] == digest:
+                print("%s is already in the history (run %d)" % (fn, run['run']))
+                return None
+
+        if kind is None:
+            kind = "update" if os.path.basename(fn).startswith("events") else "export"
+
+        cals = []
+        if fn.endswith(".zip"):
+            with ZipFile(fn) as fz:
+                for mem in fz.namelist():
+                    if mem.endswith(".ics"):
+                        calname, header, events = split_cal(fz.read(mem))
+                        cals.append((calname or os.path.splitext(mem)[0], header, events))
+        else:
+            calname, header, events = split_cal(data)
+            cals.append((calname or os.path.splitext(os.path.basename(fn))[0], header, events))
+
+        # times are utc, so they sort as strings
+        when = datetime.fromtimestamp(os.stat(fn).st_mtime, timezone.utc).isoformat(timespec='seconds')
+        run = {'run': len(self.runs) + 1, 'time': when, 'added': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'file': os.path.basename(fn), 'sha': digest, 'kind': kind, 'cals': {}, 'delta': {}}
+
+        for calname, header, events in cals:
+            emap = dict((key, self.put(block)) for key, block in events.items())
+            run['cals'][calname] = self.put(json.dumps({'header': self.put(header), 'events': emap}, sort_keys=True))
+
+            if kind == "export":
+                prev = self.last_export(calname, when)
+                before = self.calmap(prev['cals'][calname])['events'] if prev is not None else {}
+                delta = dict((key, h) for key, h in emap.items() if before.get(key) != h)
+                delta.update((key, None) for key in before if key not in emap)
+            else:
+                delta = emap
+            run['delta'][calname] = delta
+
+        os.makedirs(self.dirn, exist_ok=True)
+        with open(os.path.join(self.dirn, RUNS), "a") as fo:
+            fo.write(json.dumps(run, sort_keys=True) + "\n")
+        self.runs.append(run)
+
+        nchg = sum(len(d) for d in run['delta'].values())
+        print("%s added to history as run %d (%s, %d calendars, %d events changed)" % (fn, run['run'],
+            kind, len(cals), nchg))
+        return run
+
+    def tally(self, run):
+        ''' (added, changed, removed) events of a run, each against the export of its
+            calendar before the run. all of an update's events are "added".
+        '''
+
+        adds = chgs = dels = 0
+        for cal, delta in run['delta'].items():
+            before = {}
+            if run['kind'] == "export":
+                prev = None
+                for r in self.runs:
+                    if r['kind'] == "export" and cal in r['cals'] and (r['time'], r['run']) < (run['time'], run['run']):
+                        if prev is None or (r['time'], r['run']) > (prev['time'], prev['run']):
+                            prev = r
+                if prev is not None:
+                    before = self.calmap(prev['cals'][cal])['events']
+            for key, h in delta.items():
+                if h is None:
+                    dels += 1
+                elif key in before:
+                    chgs += 1
+                else:
+                    adds += 1
+        return adds, chgs, dels
+
+    def state(self, when):
+        ''' {calendar: (run, header, {key: block})} as of when (utc iso time), from the last
+            export of each calendar then
+        '''
+
+        cals = {}
+        for run in self.runs:
+            for cal in run['cals']:
+                if cal in cals:
+                    continue
+                last = self.last_export(cal, when)
+                if last is not None:
+                    cmap = self.calmap(last['cals'][cal])
+                    cals[cal] = (last, self.get(cmap['header']),
+                        dict((key, self.get(h)) for key, h in cmap['events'].items()))
+        return cals
+
+    def blame(self, text):
+        ''' [(run, calendar, key, what, block)] for the events whose uid or summary has text '''
+
+        text = text.lower()
+        runs = sorted(self.runs, key=lambda run: (run['time'], run['run']))
+
+        # the events that matched in any version
+        match = set()
+        for run in runs:
+            for cal, delta in run['delta'].items():
+                for key, h in delta.items():
+                    if h is not None and (text in key.lower() or text in block_label(self.get(h)).lower()):
+                        match.add((cal, key))
+
+        seen = set()
+        out = []
+        for run in runs:
+            for cal, delta in sorted(run['delta'].items()):
+                for key, h in sorted(delta.items()):
+                    if (cal, key) not in match:
+                        continue
+                    if run['kind'] == "update":
+                        what = "sent"
+                    elif h is None:
+                        what = "removed"
+                    elif (cal, key) in seen:
+                        what = "changed"
+                    else:
+                        what = "added"
+                        seen.add((cal, key))
+                    out.append((run, cal, key, what, self.get(h) if h is not None else None))
+        return out
+
+def write_cal(header, events):
+    return header + "".join(events[key] for key in sorted(events)) + "END:VCALENDAR\r\n"
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hd:")
+    except getopt.GetoptError as err:
+        usage(str(err), error=2)
+
+    dirn = ".history"
+    for o, a in opts:
+        if o == "-h":
+            usage()
+        elif o == "-d":
+            dirn = a
+
+    if len(args) == 0:
+        usage("no command given", error=1)
+
+    hist = history(dirn)
+    cmd = args[0]
+    try:
+        copts, cargs = getopt.gnu_getopt(args[1:], "uo:")
+    except getopt.GetoptError as err:
+        usage(str(err), error=2)
+    copts = dict(copts)
+
+    if cmd == "add":
+        if len(cargs) == 0:
+            usage("add needs a file", error=1)
+        for fn in cargs:
+            hist.add(fn, "update" if "-u" in copts else None)
+
+    elif cmd == "log":
+        for run in hist.runs:
+            adds, chgs, dels = hist.tally(run)
+            if run['kind'] == "update":
+                counts = "%5d events sent" % (adds)
+            else:
+                counts = "%5d added, %d changed, %d removed" % (adds, chgs, dels)
+            print("%4d %s %-6s %-30s %s" % (run['run'], run['time'], run['kind'], run['file'], counts))
+
+    elif cmd == "state":
+        if len(cargs) != 1:
+            usage("state needs a date", error=1)
+        try:
+            when = datetime.fromisoformat(cargs[0])
+        except ValueError:
+            usage("date (%s) not recognized" % (cargs[0]), error=1)
+        if len(cargs[0]) <= 10:
+            when += timedelta(days=1, seconds=-1)
+        if when.tzinfo is None:
+            when = pytz.timezone("US/Pacific").localize(when)
+
+        cals = hist.state(when.astimezone(timezone.utc).isoformat(timespec='seconds'))
+        if len(cals) == 0:
+            print("nothing exported by %s" % (cargs[0]))
+            sys.exit(1)
+        for cal, (run, header, events) in sorted(cals.items()):
+            print("%s: %d events, from run %d (%s, %s)" % (cal, len(events), run['run'], run['file'], run['time']))
+
+        ofn = copts.get("-o")
+        if ofn is not None and ofn.endswith(".zip"):
+            with ZipFile(ofn, "w") as fz:
+                for cal, (run, header, events) in sorted(cals.items()):
+                    fz.writestr(cal + ".ics", write_cal(header, events))
+            print("wrote %s" % (ofn))
+        elif ofn is not None:
+            if len(cals) > 1:
+                usage("%d calendars - -o file must be a .zip" % (len(cals)), error=1)
+            (run, header, events), = cals.values()
+            with open(ofn, "w", newline="") as fo:
+                fo.write(write_cal(header, events))
+            print("wrote %s" % (ofn))
+
+    elif cmd == "blame":
+        if len(cargs) != 1:
+            usage("blame needs some text to look for", error=1)
+        for run, cal, key, what, block in hist.blame(cargs[0]):
+            label = block_label(block) if block is not None else ""
+            print("run %d %s %-7s %s %s: %s %s" % (run['run'], run['time'], what, run['file'], cal, key[:40], label))
+
+    else:
+        usage("unknown command %s" % (cmd), error=1)
+
+if __name__ == "__main__":
+    main()
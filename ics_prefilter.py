@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+'''
+    prefilter for comparing one calendar export with another.
+
+    between two exports, most VEVENTs are the same apart from DTSTAMP (and maybe
+    LAST-MODIFIED or SEQUENCE). each VEVENT's raw text is hashed, leaving those out,
+    and the blocks found in both files are cut out of the text before icalendar
+    parses it - they can't be changes. only the rest is decoded and compared.
+
+    recurring events are left alone: a changed instance of a series is compared with
+    the instance expanded from the other file's series, so neither can be dropped.
+    events in an absences calendar are read differently (as all day), so whether the
+    calendar is one of those is part of the hash.
+
+    an event left out can still matter, if it was at the same time as another event
+    in its file - only one of two events at the same time is kept. so the day each
+    event left out starts is noted, and the ones on a day that has events which were
+    read are put back (see tuner_events.collisions), and the files read again.
+'''
+
+from hashlib import sha1
+from zipfile import ZipFile
+from datetime import datetime
+import pytz
+
+# properties that change without the event changing
+VOLATILE = ("DTSTAMP", "LAST-MODIFIED", "SEQUENCE")
+
+def salt(name):
+    return "abs" if "abs" in name else ""
+
+def start_day(line):
+    ''' the day (yyyymmdd, pacific time) of a DTSTART line '''
+
+    value = line.split(":", 1)[1].strip()
+    if value.endswith("Z"):
+        utc = pytz.utc.localize(datetime.strptime(value[:15], "%Y%m%dT%H%M%S"))
+        return utc.astimezone(pytz.timezone("US/Pacific")).strftime("%Y%m%d")
+    return value[:8]
+
+def blocks(text, name):
+    ''' yield (start, end, digest, uid, recurring, day) for each VEVENT in text, from the
+        calendar name. start and end are the offsets of the block, including its line break.
+        day is the day it starts.
+    '''
+
+    prefix = salt(name).encode('utf-8')
+    pos = 0
+    while True:
+        start = text.find("BEGIN:VEVENT", pos)
+        if start < 0:
+            return
+        end = text.find("END:VEVENT", start)
+        if end < 0:
+            return
+        end = text.find("\n", end)
+        end = len(text) if end < 0 else end + 1
+        pos = end
+
+        digest = sha1(prefix)
+        uid = None
+        day = None
+        recurring = False
+        skipping = False
+        for line in text[start:end].splitlines():
+            if line[:1] in (" ", "\t"):
+                if not skipping:
+                    digest.update(line.encode('utf-8'))
+                continue
+            pname = line.split(":", 1)[0].split(";", 1)[0].upper()
+            skipping = pname in VOLATILE
+            if skipping:
+                continue
+            if pname == "UID":
+                uid = line.split(":", 1)[1]
+            elif pname == "DTSTART":
+                day = start_day(line)
+            elif pname in ("RRULE", "RDATE", "RECURRENCE-ID"):
+                recurring = True
+            digest.update(b"\n" + line.encode('utf-8'))
+
+        yield start, end, digest.hexdigest(), uid, recurring, day
+
+def members(names, calnames):
+    ''' {calendar name: member} of the calendars calnames (prefixes, as "tuners2025_")
+        among the members names of a .zip - the first one each starts. '''
+
+    found = {}
+    for caln in calnames:
+        for mem in names:
+            if mem.startswith(caln):
+                found[caln] = mem
+                break
+    return found
+
+def texts(path, calnames=None):
+    ''' [(name, text)] of the calendars in an .ics file, or in the members of a .zip -
+        just the calendars calnames, if given
+    '''
+
+    if path.endswith(".zip"):
+        with ZipFile(path) as fz:
+            if calnames is None:
+                mems = [mem for mem in fz.namelist() if mem.endswith(".ics")]
+            else:
+                mems = members(fz.namelist(), calnames).values()
+            return [(mem, fz.read(mem).decode('utf-8')) for mem in mems]
+    with open(path, "r") as fo:
+        return [(path, fo.read())]
+
+def block_hashes(path, calnames=None):
+    ''' ({digest: uid}, {uids of recurring events}) for the VEVENTs in path '''
+
+    digests = {}
+    recurs = set()
+    for name, text in texts(path, calnames):
+        for start, end, digest, uid, recurring, day in blocks(text, name):
+            if recurring:
+                recurs.add(uid)
+            digests[digest] = uid
+    return digests, recurs
+
+def common_blocks(path1, path2, calnames=None):
+    ''' {digest} of the VEVENTs that are the same in both files, and aren't part of a
+        recurring event in either. for a .zip, only the calendars calnames (the ones
+        that will be loaded) are read.
+    '''
+
+    digests1, recurs1 = block_hashes(path1, calnames)
+    digests2, recurs2 = block_hashes(path2, calnames)
+    recurs = recurs1 | recurs2
+    return set(digest for digest, uid in digests1.items() if digest in digests2 and uid not in recurs)
+
+def drop_blocks(text, name, skip):
+    ''' text of calendar name with the VEVENTs whose digests are in skip cut out.
+        returns (text, {digest: day} of the ones cut)
+    '''
+
+    out = []
+    pos = 0
+    cut = {}
+    for start, end, digest, uid, recurring, day in blocks(text, name):
+        if digest in skip:
+            out.append(text[pos:start])
+            pos = end
+            cut[digest] = day
+    out.append(text[pos:])
+    return "".join(out), cut
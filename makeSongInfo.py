@@ -1,98 +1,220 @@
 #! /usr/bin/env python
 '''
     initialize rehearsals and performances SongInfo sheets
-    for a year. default is current year, else specify as first argument.
+    for one or more years. default is current year.
+
+    the rows come from RULES (or a json file of rules, with -r): each rule
+    says which sheet, which weekday, which weeks of the month (or every
+    week), the times and the row to put in. skip dates are left out, and
+    with -H, holidays - HOLIDAYS, or the ones in the rules file. the dates
+    for all the years are worked out at once, as day numbers, and the
+    sheets are streamed out one row at a time.
 '''
 
 import sys
-from datetime import date, time, timedelta
+import json
+import getopt
+from datetime import date, time
 from openpyxl import Workbook
 
-# day-of-week day-of-month   day-of-month
-#  for 1st     for 1st Tue    for 1st Thu
-#    6 (Sun)       3              5
-#    0 (Mon)       2              4
-#    1 (Tue)       1              3
-#    2 (Wed)       7              2
-#    3 (Thu)       6              1
-#    4 (Fri)       5              7
-#    5 (Sat)       4              6
-
-# figure out which year to do
-if len(sys.argv) > 1:
-    yr = int(sys.argv[1])
-else:
-    yr = date.today().year
-
-# Tuners rehearsal start and end times
-rehst = time(18, 0, 0)
-rehend = time(20, 0, 0)
-
-# build a date for Jan 1 of year
-jan1 = date(yr, 1, 1)
-# dow is weekday of Jan 1, 0 is Monday
-dow = jan1.weekday()
-
-# build date for 1st Tuesday in January
-tuedom = 2 - dow if dow < 2 else 9 - dow
-tue = date(yr, 1, tuedom)
-
-# build date for Jan 1 of following year
-nxtyr = yr + 1
-nxtjan1 = date(nxtyr, 1, 1)
-
-tuesdays = []
-
-# until Tue is in following year, add date to list of tuesdays
-while tue < nxtjan1:
-    tuesdays.append(tue)
-    tue += timedelta(days=7)
-
-# create a workbook, name active (only) sheet <year> Rehearsals
-wb = Workbook()
-ws = wb.active
-ws.title = "{} Rehearsals".format(yr)
-
-# add the header row to the sheet
-cols = ['Event', 'Venue', 'Date', 'Start Time', 'End Time', 'Uniform', 'Type']
-ws.append(cols)
-
-# then add a rehearsal row for each Tuesday
-for tue in tuesdays:
-    row = ['Tuners Rehearsal', 'Lewis & Clark Evt Ctr', tue, rehst, rehend, None, 'Rehearsal']
-    ws.append(row)
-    
-# add a sheet for performances and put the header row out
-ws = wb.create_sheet("{} Performances".format(yr))
-ws.append(cols)
-
-
-# typical performance from 6:30 to 7:15
-perst = time(18, 30, 0)
-perend = time(19, 15, 0)
-
-# for each month...
-for mo in range(1, 13):
-    # build date for 1st of month, get its weekday
-    mo1 = date(yr, mo, 1)
-    dow = mo1.weekday()
-
-    # calculate 1st Thursday of the month
-    thudom = 4 - dow if dow < 4 else 11 - dow
-    thu = date(yr, mo, thudom)
-
-    # add a placeholder for the performance
-    row = ['at venue', 'venue', thu, perst, perend, 'singout', 'Performance']
-    ws.append(row)
-
-    # calculate 3rd Thursday
-    thu += timedelta(days=14)
-    # and add a placeholder for that date
-    row = ['at venue', 'venue', thu, perst, perend, 'singout', 'Performance']
-    ws.append(row)
-
-# save the workbook
-wbfn = "si.xlsx"
-wb.save(wbfn)
-
-print("created {}".format(wbfn))
+WEEKDAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+# sheet: "<year> <sheet>". weeks: which (1st, 2nd... -1 is last) weekdays of the
+# month, or None for every week. row: Event, Venue, Uniform, Type.
+RULES = [
+    {'sheet': "Rehearsals", 'day': 'tue', 'weeks': None, 'start': "18:00", 'end': "20:00",
+        'row': ['Tuners Rehearsal', 'Lewis & Clark Evt Ctr', None, 'Rehearsal']},
+    {'sheet': "Performances", 'day': 'thu', 'weeks': [1, 3], 'start': "18:30", 'end': "19:15",
+        'row': ['at venue', 'venue', 'singout', 'Performance']},
+]
+
+# date: "mm-dd" every year, or month, day and week: the week'th (-1 is last) weekday of the month
+HOLIDAYS = [
+    {'name': "new year's day", 'date': "01-01"},
+    {'name': "memorial day", 'month': 5, 'day': 'mon', 'week': -1},
+    {'name': "independence day", 'date': "07-04"},
+    {'name': "labor day", 'month': 9, 'day': 'mon', 'week': 1},
+    {'name': "thanksgiving", 'month': 11, 'day': 'thu', 'week': 4},
+    {'name': "christmas eve", 'date': "12-24"},
+    {'name': "christmas", 'date': "12-25"},
+]
+
+COLS = ['Event', 'Venue', 'Date', 'Start Time', 'End Time', 'Uniform', 'Type']
+
+def usage(msg="", error=0):
+    if msg != "":
+        print("\n>>> %s\n" % (msg))
+
+    print("""Usage: %s [-h] [-o file] [-r rules.json] [-s dates] [-H] [years]
+   where:
+      -h    show this help and exit
+      -o file => workbook to write. default - si.xlsx
+      -r rules.json => rules to use instead of the built in ones. either a list of
+                rules, each
+                {"sheet": "Rehearsals", "day": "tue", "weeks": null or [1, 3],
+                 "start": "18:00", "end": "20:00", "row": [event, venue, uniform, type]}
+                (a week of -1 is the last in the month, -2 the one before...),
+                or {"rules": [...], "holidays": [...], "skip": ["2025-08-05", ...]}, a
+                holiday being {"date": "12-25"} or {"month": 11, "day": "thu", "week": 4}.
+                holidays given here are skipped without -H.
+      -s dates => dates to skip, e.g. 2025-08-05,2025-08-12. may appear more than once.
+      -H    skip holidays (new year's, memorial day, july 4th, labor day,
+                thanksgiving, christmas eve and christmas, if the rules file has none)
+      years => a year (2025) or range of years (2025-2030). default - this year.
+""" % (sys.argv[0]))
+
+    sys.exit(error)
+
+def nth_weekdays(months, wd, n):
+    ''' day numbers (date ordinals) of the nth weekday wd in each of months, a list of
+        the day numbers of the 1st of each month. n of -1 is the last one, -2 the one
+        before it...
+    '''
+
+    if n > 0:
+        days = [m1 + (wd - (m1 + 6) % 7) % 7 + 7 * (n - 1) for m1 in months]
+    else:
+        # the last one is a week before the 1st of that weekday in the next month
+        days = [nxt + (wd - (nxt + 6) % 7) % 7 + 7 * n for nxt in months[1:]]
+        months = months[:-1]
+
+    # a 5th weekday (or 5th from last) isn't in every month
+    return [d for d, m1, nxt in zip(days, months, months[1:] + [None]) if d >= m1 and (nxt is None or d < nxt)]
+
+def check_weeks(rules, hols):
+    ''' complain about a week number of a rule or holiday that isn't 1-5 or -1 to -5 '''
+
+    weeks = [n for rule in rules for n in rule.get('weeks') or []]
+    weeks += [hol['week'] for hol in hols if 'date' not in hol]
+    for n in weeks:
+        if not isinstance(n, int) or n == 0 or abs(n) > 5:
+            usage("week %s not recognized - weeks are 1 to 5, or -1 (the last) to -5" % (n,), error=1)
+
+def rule_days(rule, first, last, months):
+    ''' day numbers from first through last (day numbers) that rule falls on '''
+
+    wd = WEEKDAYS.index(rule['day'].lower()[:3])
+    if not rule.get('weeks'):
+        d0 = first + (wd - (first + 6) % 7) % 7
+        return range(d0, last + 1, 7)
+
+    days = []
+    for n in rule['weeks']:
+        days += nth_weekdays(months, wd, n)
+    return sorted(d for d in days if first <= d <= last)
+
+def holidays(hols, years):
+    ''' day numbers in years of the holidays hols (as HOLIDAYS) there are no rehearsals
+        or singouts on
+    '''
+
+    days = set()
+    for yr in years:
+        months = [date(yr, mo, 1).toordinal() for mo in range(1, 13)] + [date(yr + 1, 1, 1).toordinal()]
+        for hol in hols:
+            if 'date' in hol:
+                mo, dy = hol['date'].split("-")
+                days.add(date(yr, int(mo), int(dy)).toordinal())
+            else:
+                mo = hol['month']
+                wd = WEEKDAYS.index(hol['day'].lower()[:3])
+                days.update(d for d in nth_weekdays(months[mo - 1:mo + 1], wd, hol['week'])
+                    if months[mo - 1] <= d < months[mo])
+    return days
+
+def skip_day(s):
+    ''' the day number of a skip date, yyyy-mm-dd '''
+
+    try:
+        return date.fromisoformat(s.strip()).toordinal()
+    except ValueError:
+        usage("bad skip date %s" % (s), error=1)
+
+def hhmm(s):
+    h, m = s.split(":")
+    return time(int(h), int(m), 0)
+
+def main():
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "ho:r:s:H")
+    except getopt.GetoptError as err:
+        usage(str(err), error=2)
+
+    wbfn = "si.xlsx"
+    rules = RULES
+    hols = HOLIDAYS
+    skips = set()
+    doholidays = False
+
+    for o, a in opts:
+        if o == "-h":
+            usage()
+        elif o == "-o":
+            if not a.endswith(".xlsx"):
+                usage("-o file must end with .xlsx", error=1)
+            wbfn = a
+        elif o == "-r":
+            with open(a) as fo:
+                spec = json.load(fo)
+            if isinstance(spec, list):
+                spec = {'rules': spec}
+            rules = spec.get('rules', RULES)
+            if spec.get('holidays'):
+                hols = spec['holidays']
+                doholidays = True
+            skips.update(skip_day(d) for d in spec.get('skip', []))
+        elif o == "-s":
+            skips.update(skip_day(d) for d in a.split(","))
+        elif o == "-H":
+            doholidays = True
+
+    check_weeks(rules, hols)
+
+    # figure out which years to do
+    if len(args) > 0:
+        yrs = args[0].split("-")
+        try:
+            y1 = int(yrs[0])
+            y2 = int(yrs[-1])
+        except ValueError:
+            usage("years (%s) not recognized" % (args[0]), error=1)
+    else:
+        y1 = y2 = date.today().year
+    years = range(y1, y2 + 1)
+
+    # every date as a day number. the 1st of each month, and of the month after
+    first = date(y1, 1, 1).toordinal()
+    last = date(y2, 12, 31).toordinal()
+    months = [date(yr, mo, 1).toordinal() for yr in years for mo in range(1, 13)] + [last + 1]
+
+    if doholidays:
+        skips |= holidays(hols, years)
+
+    # sheet => {year: [(day number, start, rule number)]} for each rule's dates
+    sheets = {}
+    for n, rule in enumerate(rules):
+        st = hhmm(rule['start'])
+        byyear = sheets.setdefault(rule['sheet'], dict((yr, []) for yr in years))
+        for d in rule_days(rule, first, last, months):
+            if d not in skips:
+                byyear[date.fromordinal(d).year].append((d, st, n))
+
+    # stream out a sheet per year for each kind, in the order of the rules
+    wb = Workbook(write_only=True)
+    nrows = 0
+    for yr in years:
+        for sheet, byyear in sheets.items():
+            ws = wb.create_sheet("{} {}".format(yr, sheet))
+            ws.append(COLS)
+            for d, st, n in sorted(byyear[yr]):
+                rule = rules[n]
+                evtitl, venue, uni, typ = rule['row']
+                ws.append([evtitl, venue, date.fromordinal(d), st, hhmm(rule['end']), uni, typ])
+                nrows += 1
+
+    wb.save(wbfn)
+
+    print("created {} - {} rows for {} through {}".format(wbfn, nrows, y1, y2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+'''
+    expand recurring ics events (RRULE, RDATE, EXDATE) within a date range,
+    and find regular patterns in a set of events so they can be written as series.
+
+    occurrences are generated one at a time, and only for the requested range.
+    when the series starts long before the range, the rule is restarted at a
+    whole number of periods before the range, so the cost depends on the size
+    of the range rather than the age of the series.
+'''
+
+from datetime import datetime, timedelta, timezone
+from dateutil.rrule import rrulestr
+from dateutil.relativedelta import relativedelta
+from icalendar import vRecur
+
+# rule parts which, when all absent, make dateutil take the day (and month) from DTSTART
+DAYPARTS = ['BYWEEKNO', 'BYYEARDAY', 'BYMONTHDAY', 'BYDAY', 'BYEASTER']
+WEEKDAYS = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+
+def wall(dt, tz):
+    ''' naive wall clock time of dt in tz (dt may be a date, or naive, or aware) '''
+
+    if not isinstance(dt, datetime):
+        return datetime(dt.year, dt.month, dt.day)
+    if dt.tzinfo is None or tz is None:
+        return dt.replace(tzinfo=None)
+    return dt.astimezone(tz).replace(tzinfo=None)
+
+def unwall(dt, tz, allday):
+    ''' inverse of wall - give back a date, or a datetime in tz '''
+
+    if allday:
+        return dt.date()
+    if tz is None:
+        return dt
+    if hasattr(tz, "localize"):
+        # pytz zones must localize, not replace, or they get the wrong offset
+        return tz.localize(dt)
+    return dt.replace(tzinfo=tz)
+
+def ddd_list(sub, prop):
+    ''' all date/datetime values of a (possibly repeated) property like EXDATE or RDATE '''
+
+    vals = sub.get(prop)
+    if vals is None:
+        return []
+    if not isinstance(vals, list):
+        vals = [vals]
+    return [d.dt for v in vals for d in v.dts]
+
+def fast_forward(rule, start, before):
+    ''' given the rule parts and naive start of a series, return (rule, start) for the same
+        series restarted at a whole number of periods, not later than "before".
+        returns the originals when that can't be done without counting instances.
+    '''
+
+    freq = rule['FREQ'][0]
+    interval = int(rule.get('INTERVAL', [1])[0])
+    simple = not any(p in rule for p in DAYPARTS)
+
+    if 'COUNT' in rule:
+        # only a rule with one instance per period can be skipped ahead without counting
+        if not simple or any(p in rule for p in ['BYMONTH', 'BYHOUR', 'BYMINUTE', 'BYSETPOS']):
+            return rule, start
+        if freq in ['MONTHLY', 'YEARLY'] and start.day > 28:
+            # some months (or years) have no instance
+            return rule, start
+
+    if freq == 'DAILY':
+        step = timedelta(days=interval)
+        periods = (before - start) // step
+    elif freq == 'WEEKLY':
+        step = timedelta(weeks=interval)
+        periods = (before - start) // step
+    elif freq == 'MONTHLY':
+        months = (before.year - start.year) * 12 + before.month - start.month
+        periods = months // interval
+        step = relativedelta(months=interval)
+    elif freq == 'YEARLY':
+        periods = (before.year - start.year) // interval
+        step = relativedelta(years=interval)
+    else:
+        # sub-daily rules aren't used for anything we schedule
+        return rule, start
+
+    if periods < 1:
+        return rule, start
+
+    rule = dict(rule)
+
+    # the restart date mustn't change what dateutil would have defaulted from the original start
+    if simple:
+        if freq == 'WEEKLY':
+            rule['BYDAY'] = [WEEKDAYS[start.weekday()]]
+        elif freq == 'MONTHLY':
+            rule['BYMONTHDAY'] = [start.day]
+        elif freq == 'YEARLY':
+            rule.setdefault('BYMONTH', [start.month])
+            rule['BYMONTHDAY'] = [start.day]
+
+    if 'COUNT' in rule:
+        left = int(rule['COUNT'][0]) - periods
+        if left < 1:
+            return None, start
+        rule['COUNT'] = [left]
+
+    newstart = start + step * periods
+    if freq == 'MONTHLY':
+        newstart = newstart.replace(day=1)
+    elif freq == 'YEARLY':
+        newstart = newstart.replace(month=1, day=1)
+
+    return rule, newstart
+
+def occurrences(sub, fromdate, todate):
+    ''' yield (start, end) for each instance of recurring VEVENT sub that overlaps
+        fromdate - todate. values are dates for all day events, else datetimes in the
+        time zone of DTSTART.
+    '''
+
+    dtstart = sub['DTSTART'].dt
+    if 'DTEND' in sub:
+        dtend = sub['DTEND'].dt
+    elif 'DURATION' in sub:
+        dtend = dtstart + sub['DURATION'].dt
+    else:
+        dtend = dtstart
+
+    allday = not isinstance(dtstart, datetime)
+    tz = None if allday else dtstart.tzinfo
+
+    start = wall(dtstart, tz)
+    length = wall(dtend, tz) - start
+
+    # instances that start in [lo, hi] overlap the range
+    lo = wall(fromdate, tz) - length
+    hi = wall(todate, tz)
+
+    exdates = set(wall(d, tz) for d in ddd_list(sub, 'EXDATE'))
+
+    def keep(dt):
+        return lo <= dt <= hi and dt not in exdates
+
+    instances = []
+
+    rrules = sub.get('RRULE')
+    if rrules is not None and not isinstance(rrules, list):
+        rrules = [rrules]
+
+    for rrule in rrules or []:
+        rule = dict(rrule)
+        if 'UNTIL' in rule:
+            # expansion runs in wall time, so UNTIL must be too
+            rule['UNTIL'] = [wall(rule['UNTIL'][0], tz)]
+
+        rule, rstart = fast_forward(rule, start, lo)
+        if rule is None:
+            continue
+
+        rr = rrulestr(vRecur(rule).to_ical().decode(), dtstart=rstart)
+
+        # dateutil doesn't count dtstart as an instance unless the rule matches it
+        if rstart == start and keep(start):
+            instances.append(start)
+
+        for dt in rr.xafter(lo, inc=True):
+            if dt > hi:
+                break
+            if keep(dt):
+                instances.append(dt)
+
+    if rrules is None and keep(start):
+        instances.append(start)
+
+    for rd in ddd_list(sub, 'RDATE'):
+        dt = wall(rd, tz)
+        if keep(dt):
+            instances.append(dt)
+
+    for dt in sorted(set(instances)):
+        yield unwall(dt, tz, allday), unwall(dt + length, tz, allday)
+
+def nth_weekday(d):
+    ''' which (1st, 2nd, ...) of its weekday in the month d is '''
+    return (d.day - 1) // 7 + 1
+
+def weekly_slots(first, last):
+    ''' every date from first through last, a week apart '''
+    return [first + timedelta(weeks=w) for w in range((last - first).days // 7 + 1)]
+
+def monthly_slots(first, last, nths):
+    ''' the nths (e.g. 1st and 3rd) weekdays of each month, first through last '''
+
+    slots = []
+    d = first - timedelta(weeks=nth_weekday(first) - 1)     # 1st of this weekday in first's month
+    while d <= last:
+        if d >= first and nth_weekday(d) in nths:
+            slots.append(d)
+        d += timedelta(weeks=1)
+    return slots
+
+def find_series(events, minrun=4):
+    ''' find regular patterns in events, a dict of {(start, end): event}.
+        candidates are grouped by weekday, start time and length; each group is fitted
+        as weekly, or as the nth weekdays of the month (e.g. 1st and 3rd Thursdays).
+        missing dates become EXDATEs, and events that differ from the most common
+        title/venue/uniform/type become overrides of their instance.
+
+        returns a list of dicts with: rule (RRULE parts), first (s_e of first instance),
+        fields (the series event), exdates (starts), instances ({s_e: event} covered),
+        and overrides ({s_e: event} which differ from fields).
+    '''
+
+    groups = {}
+    for s_e, ev in events.items():
+        (evst, evend) = s_e
+        groups.setdefault((evst.weekday(), evst.time(), evend - evst), []).append(s_e)
+
+    series = []
+    for (dow, sttime, length), keys in groups.items():
+        if len(keys) < minrun:
+            continue
+
+        bydate = dict((s_e[0].date(), s_e) for s_e in keys)
+        dates = sorted(bydate)
+
+        # weekly takes every date. monthly takes the dates on the nths (1st, 3rd...)
+        # that most of the group falls on - an odd date moved to a 5th week stays single.
+        fits = [({'FREQ': ['WEEKLY']}, weekly_slots(dates[0], dates[-1]), dates)]
+
+        counts = {}
+        for d in dates:
+            counts[nth_weekday(d)] = counts.get(nth_weekday(d), 0) + 1
+        nths = sorted(n for n in counts if counts[n] * 4 >= len(dates))
+        if 0 < len(nths) < 4:
+            ondates = [d for d in dates if nth_weekday(d) in nths]
+            byday = ["%d%s" % (n, WEEKDAYS[dow]) for n in nths]
+            fits.append(({'FREQ': ['MONTHLY'], 'BYDAY': byday}, monthly_slots(ondates[0], ondates[-1], nths), ondates))
+
+        def cost(fit):
+            rule, slots, ondates = fit
+            return len(slots) - len(ondates) + len(dates) - len(ondates)
+
+        rule, slots, ondates = min(fits, key=cost)
+        keys = [bydate[d] for d in ondates]
+        if len(keys) < minrun:
+            continue
+        missing = [d for d in slots if d not in bydate]
+
+        # the series takes the most common fields, the rest are overrides
+        counts = {}
+        for s_e in keys:
+            ev = events[s_e]
+            flds = (ev.get('title'), ev.get('venue'), ev.get('uni'), ev.get('type'))
+            counts[flds] = counts.get(flds, 0) + 1
+        common = max(counts, key=counts.get)
+        fields = dict(zip(['title', 'venue', 'uni', 'type'], common))
+
+        overrides = {}
+        for s_e in keys:
+            ev = events[s_e]
+            if (ev.get('title'), ev.get('venue'), ev.get('uni'), ev.get('type')) != common:
+                overrides[s_e] = ev
+
+        if (len(missing) + len(overrides)) * 2 > len(keys):
+            # too irregular for a series to be any smaller
+            continue
+
+        tz = keys[0][0].tzinfo
+        rule['UNTIL'] = [keys[-1][0].astimezone(timezone.utc)]
+
+        exdates = [unwall(datetime.combine(d, sttime), tz, False) for d in missing]
+
+        series.append({'rule': rule, 'first': keys[0], 'fields': fields, 'exdates': exdates,
+            'instances': dict((s_e, events[s_e]) for s_e in keys), 'overrides': overrides})
+
+    return series
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+'''
+    round trip test of the .ics writer and reader.
+
+    a made up set of events - rehearsals, performances (at venues, with uniforms,
+    titles with commas, semicolons, accents...), board meetings and absences - is
+    written by event_changes.cal_events, then read back by tuner_events, the way an
+    export would be. absences go in their own calendar, with "abs" in its name, like
+    the google export, so they take the all day path.
+
+    absences are made in each of the shapes they are loaded in: all day as in an
+    .ics (ending at midnight), all day as in the workbook (ending at 23:59:59 a day
+    after the last day), and from 9 to 5, as some calendars enter them. each should
+    come back as the workbook has it - see back_key.
+
+    reports events/sec each way and the peak memory, and lists any event that
+    didn't come back, came back extra, or came back different. exits 1 if any did.
+
+    the calendar has no way to say "no uniform" other than leaving it out, so a
+    uniform of None and one of "" are the same here.
+'''
+
+import os, sys
+sys.dont_write_bytecode = True
+import getopt
+import time
+import random
+import resource
+import tempfile
+from datetime import datetime, timedelta
+import pytz
+
+import diag
+from tuner_events import tuner_events
+from event_changes import event_changes
+
+FIELDS = ['title', 'venue', 'uni', 'type']
+
+VENUES = {
+    'Lewis & Clark Evt Ctr': ("117 W Magnolia St", "Centralia, WA 98531"),
+    'Country Cousin': ("1054 Harrison Ave", "Centralia, WA 98531"),
+    'Woodland Village': ("2500 Woodland Dr; Bldg 2", "Chehalis, WA 98532"),
+    'Café Olé, Main St': ("12 Main St", "Chehalis, WA 98532"),
+}
+
+TITLES = ["Vintage @ Chehalis", "Banquet", "Sing-out; with guests", "Holiday show, part 2",
+    "Noël concert", "Back\\slash night", "Spring \"Gala\""]
+UNIS = [None, "", "singout", "formal, with vests", "- none -"]
+PEOPLE = ["Bob", "Jane", "Sharon Care", "Zoë"]
+
+def usage(msg="", error=0):
+    if msg != "":
+        print("\n>>> %s\n" % (msg))
+
+    print("""Usage: %s [-h] [-n events] [-s seed] [-r] [-k dir]
+   where:
+      -h    show this help and exit
+      -n events => how many events to make. default - 5000
+      -s seed => random seed, for a different (but repeatable) set. default - 1
+      -r    write regular patterns as recurring events (like perfcal --rrule)
+      -k dir => write the .ics files in dir, and keep them. default - a temporary
+                directory, removed after.
+""" % (sys.argv[0]))
+
+    sys.exit(error)
+
+def corpus(n, seed):
+    ''' {s_e: event} of n made up events, starting Jan 2023. up to 16 events a day. '''
+
+    rnd = random.Random(seed)
+    pst = pytz.timezone("US/Pacific")
+    day0 = datetime(2023, 1, 1)
+    events = {}
+
+    i = 0
+    day = 0
+    while len(events) < n:
+        date = day0 + timedelta(days=day)
+        # weekly rehearsal
+        if date.weekday() == 1:
+            st = pst.localize(date.replace(hour=18))
+            events[st, st + timedelta(hours=2)] = {'title': "Tuners Rehearsal",
+                'venue': 'Lewis & Clark Evt Ctr', 'uni': None, 'type': "Rehearsal"}
+
+        # performances and meetings, on the quarter hour
+        for k in range(rnd.randint(0, 14)):
+            if len(events) >= n:
+                break
+            st = pst.localize(date.replace(hour=8 + k, minute=rnd.choice([0, 15, 30, 45])))
+            end = st + timedelta(minutes=rnd.choice([30, 45, 60, 90]))
+            if rnd.random() < 0.1:
+                ev = {'title': "Board meeting", 'venue': 'Country Cousin', 'uni': "", 'type': "Meeting"}
+            else:
+                ev = {'title': rnd.choice(TITLES), 'venue': rnd.choice(list(VENUES)),
+                    'uni': rnd.choice(UNIS), 'type': rnd.choice(["Performance", "Other", "Social Event"])}
+            events[st, end] = ev
+
+        # an absence, now and then
+        if rnd.random() < 0.2 and len(events) < n:
+            ndays = rnd.randint(1, 6)
+            shape = rnd.choice(["ics", "workbook", "hours"])
+            if shape == "ics":
+                st = pst.localize(date)
+                end = pst.localize(date + timedelta(days=ndays))
+            elif shape == "workbook":
+                st = pst.localize(date)
+                end = pst.localize(date + timedelta(days=ndays, hours=23, minutes=59, seconds=59))
+            else:
+                st = pst.localize(date.replace(hour=9))
+                end = pst.localize(date + timedelta(days=ndays - 1, hours=17))
+            events[st, end] = {'title': rnd.choice(PEOPLE), 'venue': "", 'type': "absences"}
+
+        i += 1
+        day += 1
+
+    return events
+
+def back_key(s_e, ev):
+    ''' the key an event should be read back with. an absence is whole days, ending at
+        23:59:59 a day after its last day, however it was written.
+    '''
+
+    if ev['type'] != "absences":
+        return s_e
+    pst = pytz.timezone("US/Pacific")
+    (st, end) = s_e
+    last = end.date()
+    if (end.hour, end.minute, end.second) in [(0, 0, 0), (23, 59, 59)]:
+        last -= timedelta(days=1)
+    return (pst.localize(datetime(st.year, st.month, st.day)),
+        pst.localize(datetime(last.year, last.month, last.day, 23, 59, 59) + timedelta(days=1)))
+
+def peak_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def same(f, a, b):
+    if f == 'uni':
+        return (a or "") == (b or "")
+    return a == b
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hn:s:rk:")
+    except getopt.GetoptError as err:
+        usage(str(err), error=2)
+
+    n = 5000
+    seed = 1
+    dorrule = False
+    keepdir = None
+    for o, a in opts:
+        if o == "-h":
+            usage()
+        elif o == "-n":
+            try:
+                n = int(a)
+            except ValueError:
+                usage("-n %s isn't a number" % (a), error=1)
+        elif o == "-s":
+            seed = int(a)
+        elif o == "-r":
+            dorrule = True
+        elif o == "-k":
+            keepdir = a
+
+    # the loaders and writers have their say only if something is wrong
+    diag.setup(diag.WARN)
+
+    t0 = time.perf_counter()
+    events = corpus(n, seed)
+    print("made %d events in %.2fs" % (len(events), time.perf_counter() - t0))
+
+    first = min(s_e[0] for s_e in events)
+    last = max(s_e[1] for s_e in events)
+    dotypes = {'a': True, 'b': True, 'p': True, 'r': True}
+
+    tmpdir = None
+    if keepdir is None:
+        tmpdir = tempfile.TemporaryDirectory()
+        dirn = tmpdir.name
+    else:
+        os.makedirs(keepdir, exist_ok=True)
+        dirn = keepdir
+
+    # absences go to their own calendar, as in the google export
+    parts = [("tuners-rt.ics", dict((s_e, ev) for s_e, ev in events.items() if ev['type'] != "absences")),
+        ("tunersboardabs-rt.ics", dict((s_e, ev) for s_e, ev in events.items() if ev['type'] == "absences"))]
+
+    back = {}
+    twrite = tread = 0.0
+    for fn, evs in parts:
+        if not evs:
+            continue
+        ofn = os.path.join(dirn, fn)
+
+        src = tuner_events(None, dotypes, None, fromdate=first, todate=last)
+        src.events = evs
+        src.venue_addrs = dict(VENUES)
+        chg = event_changes([src, None], show_detail=False, rrules=dorrule)
+        chg.events = dict(evs)
+
+        t0 = time.perf_counter()
+        chg.cal_events(ofn)
+        twrite += time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        got = tuner_events(ofn, dotypes, None, fromdate=first, todate=last)
+        tread += time.perf_counter() - t0
+        back.update(got.events)
+
+    diag.flush()
+
+    # what's read back is compared with what should have been
+    sent = events
+    events = dict((back_key(s_e, ev), ev) for s_e, ev in sent.items())
+
+    missing = [s_e for s_e in events if s_e not in back]
+    extra = [s_e for s_e in back if s_e not in events]
+    drift = []
+    for s_e, ev in events.items():
+        if s_e in back:
+            for f in FIELDS:
+                if f in ev and not same(f, ev[f], back[s_e].get(f)):
+                    drift.append((s_e, f, ev[f], back[s_e].get(f)))
+
+    print("wrote %d events in %.2fs - %.0f events/sec" % (len(sent), twrite, len(sent) / max(twrite, 1e-9)))
+    print("read  %d events in %.2fs - %.0f events/sec" % (len(back), tread, len(back) / max(tread, 1e-9)))
+    print("peak memory %.1f MB" % (peak_mb()))
+
+    for s_e in sorted(missing)[:10]:
+        print("missing: %s - %s %s" % (s_e[0].strftime("%Y-%m-%d %H:%M"), s_e[1].strftime("%Y-%m-%d %H:%M:%S"),
+            events[s_e]['title']))
+    for s_e in sorted(extra)[:10]:
+        print("extra:   %s - %s %s" % (s_e[0].strftime("%Y-%m-%d %H:%M"), s_e[1].strftime("%Y-%m-%d %H:%M:%S"),
+            back[s_e]['title']))
+    for s_e, f, was, got in sorted(drift, key=lambda d: d[0])[:10]:
+        print("drift:   %s %s: %r came back as %r" % (s_e[0].strftime("%Y-%m-%d %H:%M"), f, was, got))
+
+    if tmpdir is not None:
+        tmpdir.cleanup()
+
+    if missing or extra or drift:
+        print("FAILED: %d missing, %d extra, %d fields changed" % (len(missing), len(extra), len(drift)))
+        sys.exit(1)
+    print("round trip OK")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+'''
+    remember what has already been sent to the calendar.
+
+    the state file has an entry for each event written to an update file: the uid it
+    was given, a fingerprint of its contents, its status and the sequence number of
+    the last version written. changes already written (and imported) are dropped from
+    later update files, even when the export being compared against is stale.
+'''
+
+import os
+import json
+from hashlib import sha1
+from datetime import datetime
+
+STATE_VERSION = 1
+
+class sync_state():
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.entries = {}
+
+        if os.path.exists(fn):
+            with open(fn, "r") as fo:
+                state = json.load(fo)
+            if state.get('version') != STATE_VERSION:
+                raise ValueError("%s: unknown sync state version %s" % (fn, state.get('version')))
+            self.entries = state['events']
+
+    @staticmethod
+    def key(s_e):
+        (evstrt, evend) = s_e
+        return "%s|%s" % (evstrt.isoformat(), evend.isoformat())
+
+    @staticmethod
+    def fingerprint(ev):
+        flds = [str(ev.get(f) or "") for f in ['title', 'venue', 'uni', 'type']]
+        return sha1("\x1f".join(flds).encode('utf-8')).hexdigest()
+
+    def screen(self, s_e, ev):
+        ''' check a change (from event_changes) against what earlier runs wrote. returns None
+            if it was already sent, else the event to send - with the uid used before, if
+            any, and the next sequence number.
+        '''
+
+        entry = self.entries.get(self.key(s_e))
+        if entry is None:
+            return dict(ev, sequence=0)
+
+        if ev.get('status') == 'CANCELLED':
+            sent = entry['status'] == 'CANCELLED'
+        else:
+            sent = entry['status'] != 'CANCELLED' and entry['fp'] == self.fingerprint(ev)
+
+        if sent:
+            return None
+
+        # send it again as a new version of the event we sent before
+        ev = dict(ev, sequence=entry['seq'] + 1)
+        if 'uid' not in ev:
+            ev['uid'] = entry['uid']
+            if entry.get('recurid'):
+                ev['recurid'] = datetime.fromisoformat(entry['recurid']).astimezone(s_e[0].tzinfo)
+        return ev
+
+    def cancels(self, current, fromdate, todate):
+        ''' with no old calendar to compare against, events sent before (and not yet
+            cancelled) that are in the date range but no longer current must be cancelled.
+            returns {s_e: event} for those.
+        '''
+
+        keys = set(self.key(s_e) for s_e in current)
+        drops = {}
+        for k, entry in self.entries.items():
+            if k in keys or entry['status'] == 'CANCELLED':
+                continue
+            evstrt, evend = [datetime.fromisoformat(t).astimezone(fromdate.tzinfo) for t in k.split("|")]
+            if evend < fromdate or evstrt > todate:
+                continue
+            ev = {'title': entry['title'], 'type': entry['type'], 'uid': entry['uid'], 'status': 'CANCELLED'}
+            if entry.get('recurid'):
+                ev['recurid'] = datetime.fromisoformat(entry['recurid']).astimezone(evstrt.tzinfo)
+            drops[(evstrt, evend)] = ev
+        return drops
+
+    def record(self, events, emitted):
+        ''' note the changes just written. emitted maps s_e to the (uid, recurid) used. '''
+
+        for s_e, ev in events.items():
+            uid, recurid = emitted.get(s_e, (ev.get('uid'), ev.get('recurid')))
+            self.entries[self.key(s_e)] = {
+                'uid': str(uid),
+                'recurid': recurid.isoformat() if recurid is not None else None,
+                'fp': self.fingerprint(ev),
+                'status': ev.get('status', 'CONFIRMED'),
+                'seq': ev.get('sequence', 0),
+                'title': str(ev.get('title') or ""),
+                'type': str(ev.get('type') or ""),
+            }
+
+    def save(self):
+        tmpfn = self.fn + ".tmp"
+        with open(tmpfn, "w") as fo:
+            json.dump({'version': STATE_VERSION, 'events': self.entries}, fo, indent=1, sort_keys=True)
+        os.replace(tmpfn, self.fn)
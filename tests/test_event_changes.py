@@ -0,0 +1,51 @@
+import os
+from datetime import date, timedelta
+
+import event_set
+from event_changes import stream_changes
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+WORKBOOK = os.path.join(os.path.dirname(HERE), "SingoutInfo.xlsx")
+
+def loaded(path):
+    return event_set.load(path, fromdate=date(2023, 1, 1), todate=date(2023, 3, 31))
+
+def sent(tmp_path):
+    ''' the workbook's events, and the calendar they were sent to - with the uids made for them '''
+
+    cur = loaded(WORKBOOK)
+    ofn = str(tmp_path / "sent.ics")
+    event_set.write(event_set.changes(cur), ofn)
+    return cur, loaded(ofn)
+
+def move(evs, s_e, by):
+    ev = evs.events.pop(s_e)
+    evs.events[(s_e[0] + by, s_e[1])] = ev
+
+def feeds(cur, old):
+    batch = event_set.diff(cur, old)
+    stream = list(stream_changes(iter(cur), iter(old)))
+    return batch, stream
+
+def test_same_day_move_is_a_modify(tmp_path):
+    cur, old = sent(tmp_path)
+    s_e = next(s_e for s_e, ev in cur if ev.get('type') == "Rehearsal")
+    move(cur, s_e, timedelta(minutes=30))
+
+    batch, stream = feeds(cur, old)
+
+    assert [rec['action'] for rec in batch] == ['modify']
+    assert batch[0]['uid'] == old.events[s_e]['uid']
+    assert stream == batch
+
+def test_stream_and_batch_agree(tmp_path):
+    cur, old = sent(tmp_path)
+    keys = [s_e for s_e, ev in cur]
+    move(cur, keys[0], timedelta(minutes=30))
+    move(cur, keys[5], timedelta(days=2))
+    del cur.events[keys[9]]
+
+    batch, stream = feeds(cur, old)
+
+    key = lambda rec: (rec['action'], rec['key'])
+    assert sorted(stream, key=key) == sorted(batch, key=key)
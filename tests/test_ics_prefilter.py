@@ -0,0 +1,33 @@
+from zipfile import ZipFile
+
+from ics_prefilter import texts, common_blocks
+
+CAL = """BEGIN:VCALENDAR
+BEGIN:VEVENT
+UID:{uid}
+DTSTART:20230103T180000
+DTEND:20230103T200000
+SUMMARY:Rehearsal
+END:VEVENT
+END:VCALENDAR
+"""
+
+def export(path, cals):
+    with ZipFile(path, "w") as fz:
+        for name, uid in cals:
+            fz.writestr(name, CAL.format(uid=uid))
+    return str(path)
+
+def test_only_named_calendars_are_read(tmp_path):
+    cals = [("tuners2023_a.ics", "one"), ("tunersboardabs2023_b.ics", "two"), ("other2023_c.ics", "three")]
+    fn = export(tmp_path / "cals.zip", cals)
+
+    assert [name for name, text in texts(fn)] == [name for name, uid in cals]
+    assert [name for name, text in texts(fn, ["tuners2023_", "tunersboardabs2023_"])] == [name for name, uid in cals[:2]]
+
+def test_common_blocks_of_named_calendars(tmp_path):
+    fn1 = export(tmp_path / "one.zip", [("tuners2023_a.ics", "one"), ("other2023_c.ics", "three")])
+    fn2 = export(tmp_path / "two.zip", [("tuners2023_a.ics", "one"), ("other2023_c.ics", "three")])
+
+    assert len(common_blocks(fn1, fn2)) == 2
+    assert len(common_blocks(fn1, fn2, ["tuners2023_"])) == 1
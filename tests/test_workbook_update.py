@@ -0,0 +1,74 @@
+import os
+from datetime import datetime
+import pytz
+
+import diag
+
+from tuner_events import tuner_events
+from workbook_update import update_workbook
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+WORKBOOK = os.path.join(os.path.dirname(HERE), "SingoutInfo.xlsx")
+ALL = dict(a=True, b=True, p=True, r=True)
+
+pst = pytz.timezone("US/Pacific")
+
+def load(fn):
+    return tuner_events(fn, ALL, None, fromdate=pst.localize(datetime(2023, 1, 1)),
+        todate=pst.localize(datetime(2023, 12, 31, 23, 59, 59)))
+
+def test_added_event_reads_back(tmp_path):
+    # the first row after the rehearsals is formatted already, but not as a date
+    s_e = (pst.localize(datetime(2023, 12, 30, 18, 30)), pst.localize(datetime(2023, 12, 30, 20, 0)))
+    ev = {'title': "Extra Rehearsal", 'venue': "Lewis & Clark Evt Ctr", 'uni': None, 'type': "Rehearsal"}
+    ofn = str(tmp_path / "out.xlsx")
+
+    assert update_workbook(WORKBOOK, ofn, {s_e: ev}, {}, set()) == 1
+
+    before = load(WORKBOOK).events
+    after = load(ofn).events
+    assert s_e not in before
+    assert after[s_e]['title'] == "Extra Rehearsal"
+    assert len(after) == len(before) + 1
+
+def test_changes_read_back(tmp_path):
+    before = load(WORKBOOK).events
+    keys = sorted(s_e for s_e, ev in before.items() if ev.get('type') == "Rehearsal")
+    mod, cancel = keys[0], keys[1]
+    changes = {mod: dict(before[mod], title="Renamed Rehearsal", status='MODIFIED'),
+        cancel: dict(before[cancel], status='CANCELLED')}
+    ofn = str(tmp_path / "out.xlsx")
+
+    assert update_workbook(WORKBOOK, ofn, changes, {}, set()) == 2
+
+    after = load(ofn).events
+    assert after[mod]['title'] == "Renamed Rehearsal"
+    assert cancel not in after
+
+def test_update_in_place(tmp_path):
+    fn = str(tmp_path / "info.xlsx")
+    with open(WORKBOOK, "rb") as fi, open(fn, "wb") as fo:
+        fo.write(fi.read())
+    s_e = (pst.localize(datetime(2023, 12, 30, 18, 30)), pst.localize(datetime(2023, 12, 30, 20, 0)))
+    ev = {'title': "Extra Rehearsal", 'venue': "Lewis & Clark Evt Ctr", 'uni': None, 'type': "Rehearsal"}
+
+    update_workbook(fn, fn, {s_e: ev}, {}, set())
+
+    assert load(fn).events[s_e]['title'] == "Extra Rehearsal"
+
+def test_messages_go_to_diag(tmp_path, capsys):
+    # a new venue, and an event for a year the workbook has no sheet for
+    new = (pst.localize(datetime(2023, 12, 30, 18, 30)), pst.localize(datetime(2023, 12, 30, 20, 0)))
+    far = (pst.localize(datetime(2030, 1, 5, 18, 30)), pst.localize(datetime(2030, 1, 5, 20, 0)))
+    events = {new: {'title': "Extra Rehearsal", 'venue': "Nowhere Hall", 'uni': None, 'type': "Rehearsal"},
+        far: {'title': "Far Rehearsal", 'venue': "Nowhere Hall", 'uni': None, 'type': "Rehearsal"}}
+
+    diag.capture()
+    try:
+        update_workbook(WORKBOOK, str(tmp_path / "out.xlsx"), events, {}, set())
+    finally:
+        kept = diag.release()
+
+    assert capsys.readouterr().out == ""
+    cats = [cat for level, cat, msg in kept]
+    assert "venue" in cats and "sheet" in cats
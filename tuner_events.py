@@ -16,11 +16,139 @@ from zipfile import ZipFile
 from openpyxl import load_workbook
 import io
 from copy import copy
+from operator import itemgetter
+import heapq
+from event_snapshot import snapshot, write_snapshot
+from recurrence import occurrences
+from dedupe import find_duplicates
+from ics_prefilter import drop_blocks, members
+from event_map import event_map
+import diag
+
+# columns read from the event and absences sheets: (field, header names, default position).
+# a column is found by its header; if no header matches, the default position is used,
+# unless another column's header claims it.
+EVENT_COLUMNS = [
+    ('title', ["event", "title"], 0),
+    ('venue', ["venue"], 1),
+    ('date', ["date"], 2),
+    ('start', ["start time", "start"], 3),
+    ('end', ["end time", "end"], 4),
+    ('uni', ["uniform", "uni"], 5),
+    ('type', ["type", "event type"], 6),
+]
+ABSENCE_COLUMNS = [
+    ('start', ["start", "from"], 0),
+    ('end', ["end", "to"], 1),
+    ('desc', ["who", "description", "desc"], 2),
+]
+
+def column_positions(hdrs, columns):
+    ''' {field: position (0 based)} of the columns of a sheet with header row hdrs '''
+
+    names = [str(h).strip().lower() if h is not None else None for h in hdrs]
+
+    where = {}
+    for fld, hnames, pos in columns:
+        for n, name in enumerate(names):
+            if name in hnames:
+                where[fld] = n
+                break
+
+    claimed = set(where.values())
+    for fld, hnames, pos in columns:
+        if fld not in where and pos not in claimed:
+            where[fld] = pos
+            claimed.add(pos)
+    return where
+
+def column_plan(hdrs, columns):
+    ''' compile the header row of a sheet into a plan for reading its rows.
+        returns (min_col, max_col, decode) - only columns min_col to max_col (1 based)
+        need to be read, and decode(row) gives a tuple of the column values in the
+        order of columns. a column which isn't in the sheet decodes as None.
+    '''
+
+    where = column_positions(hdrs, columns)
+    lo = min(where.values())
+    hi = max(where.values())
+    offsets = [where[fld] - lo if fld in where else None for fld, hnames, pos in columns]
+
+    if None not in offsets:
+        fetch = itemgetter(*offsets)
+        return lo + 1, hi + 1, fetch
+
+    def decode(row):
+        return tuple(row[i] if i is not None else None for i in offsets)
+    return lo + 1, hi + 1, decode
+
+# how far out of date order a sheet's rows can be, and still be streamed in order
+REORDER = timedelta(days=7)
+
+def in_order(rows, what):
+    ''' yield rows ((s_e, event)) in order, holding back just enough of them to put
+        rows up to REORDER out of place back in order
+    '''
+
+    held = []
+    n = 0
+    last = None
+    for s_e, ev in rows:
+        n += 1
+        if last is not None and s_e < last:
+            diag.warn("order", "%s: %s on %s is more than %d days out of order", what, ev['title'],
+                s_e[0].strftime("%m/%d/%Y"), REORDER.days)
+        heapq.heappush(held, (s_e, n, ev))
+        while held[0][0][0] < s_e[0] - REORDER:
+            last, _, hev = heapq.heappop(held)
+            yield last, hev
+    while held:
+        last, _, hev = heapq.heappop(held)
+        yield last, hev
+
+def event_kind(ev):
+    ''' which of the -a/-b/-p/-r groups an event belongs to. untyped events are performances. '''
+
+    typ = ev.get('type') or ""
+    if typ == "absences":
+        return 'a'
+    elif typ == "Rehearsal":
+        return 'r'
+    elif typ == "Meeting":
+        return 'b'
+    return 'p'
+
+def event_end(s_e, ev):
+    ''' when an event really ends. a workbook absence ends at 23:59:59 a day after its
+        last day - the day google would leave off (see sheet_rows) - so that day is
+        taken back off.
+    '''
+
+    (evst, evend) = s_e
+    if event_kind(ev) == 'a' and (evend.hour, evend.minute, evend.second) == (23, 59, 59):
+        return evend - timedelta(days=1)
+    return evend
+
+def zip_calnames(fromdate, todate, dotypes):
+    ''' the calendars of a .zip export read for fromdate through todate, when none are
+        named - the year's tuners calendar and, for absences, its board absences one
+    '''
+
+    yrs = sorted([int(fromdate.year), int(todate.year) + 1])
+    calnames = []
+    for yr in range(yrs[0], yrs[1]):
+        calnames.append("tuners{}_".format(yr))
+        if dotypes['a']:
+            calnames.append("tunersboardabs{}_".format(yr))
+    return calnames
 
 class tuner_events():
 
-    def __init__(self, infile, dotypes, caln, outext=None, fromdate=None, todate=None):
+    def __init__(self, infile, dotypes, caln, outext=None, fromdate=None, todate=None, stream=False, skip=None):
         self.infile = infile
+        # digests of VEVENTs to leave out (see ics_prefilter), and the day of each one that was
+        self.skip = skip
+        self.skipped = {}
         self.outext = outext
         self.calnames = caln
 
@@ -33,15 +161,23 @@ class tuner_events():
 
         self.venue_addrs = {}
 
-        self.events = {}
+        self.events = event_map()
 
-        if self.infile is None:
+        if stream:
+            # nothing loaded - the events are read by stream()
+            self.event_source = "xls" if infile is not None and ".xls" in infile else "ical"
+            self.event_class = self
+        elif self.infile is None:
             self.event_source = "none"
             self.event_class = self
         elif ".xls" in self.infile:
             self.exc_events()
             self.event_source = "xls"
             self.event_class = self
+        elif self.infile.endswith(".evs"):
+            # event_source is set from the snapshot
+            self.snap_events()
+            self.event_class = self
         else:
             self.ics_events()
             self.event_source = "ical"
@@ -67,19 +203,19 @@ class tuner_events():
                 rv = 2
                 break
 
-        if rv > 0:
+        if rv > 0 and diag.level >= diag.WARN:
             sdat1 = evst.strftime("%m/%d/%Y")
             timstr1 = evst.strftime("%H:%M %p")
             timend1 = evnd.strftime("%H:%M %p")
             sdat2 = evstrt.strftime("%m/%d/%Y")
             timstr2 = evstrt.strftime("%H:%M %p")
             timend2 = evend.strftime("%H:%M %p")
-            print("event overlap:    date      start    end   event")
-            print("               %s %s %s %s" % (sdat1, timstr1, timend1, self.events[s_e]['title']))
-            print("               %s %s %s %s" % (sdat2, timstr2, timend2, title))
-            if rv == 1:
-                print("....SECOND EVENT DISCARDED....")
-            print()
+            diag.warn("overlap", "event overlap:    date      start    end   event\n"
+                "               %s %s %s %s\n               %s %s %s %s%s\n", sdat1, timstr1, timend1,
+                self.events[s_e]['title'], sdat2, timstr2, timend2, title,
+                "\n....SECOND EVENT DISCARDED...." if rv == 1 else "")
+        elif rv > 0:
+            diag.count("overlap")
 
         return rv
 
@@ -117,9 +253,14 @@ class tuner_events():
             if self.dotypes['a']:
                 self.dosheet("absences", yr)
 
-        ## ? self.wb.Close(False)
+        # read-only workbooks keep the file open until closed. drop it, too,
+        # so a loaded event set can be pickled back from a worker process.
+        self.wb.close()
+        self.wb = None
+
+    def sheet_rows(self, evtypes, yr):
+        ''' yield (s_e, event) for the rows of a sheet that are in the date range '''
 
-    def dosheet(self, evtypes, yr):
         # evtypes is "Performances" or "Rehearsals" or "board mtgs" or "absences"
         perfsheet = "%d %s" % (yr, evtypes)
         # print("dosheet {}".format(perfsheet))
@@ -127,7 +268,7 @@ class tuner_events():
         try:
             sh = self.wb[perfsheet]
         except Exception:
-            print("no such sheet: {}".format(perfsheet))
+            diag.info("sheet", "no such sheet: %s", perfsheet)
             return
 
         hdrs = list(list(sh.iter_rows(max_row=1, values_only=True))[0])
@@ -141,9 +282,16 @@ class tuner_events():
         # print("sheet %s has %d columns" % (perfsheet, len(hdrs)))
         # print("fromdate: %s, todate: %s" % (self.fromdate, self.todate))
 
+        # read just the columns we use, wherever they are
         if evtypes == "absences":
-            for row in sh.iter_rows(min_row=2, values_only=True):
-                stdate, enddate, desc = list(row)
+            mincol, maxcol, decode = column_plan(hdrs, ABSENCE_COLUMNS)
+        else:
+            mincol, maxcol, decode = column_plan(hdrs, EVENT_COLUMNS)
+        rows = sh.iter_rows(min_row=2, min_col=mincol, max_col=maxcol, values_only=True)
+
+        if evtypes == "absences":
+            for row in rows:
+                stdate, enddate, desc = decode(row)
 
                 if stdate is None:
                     break # empty date column signals end of data
@@ -158,7 +306,7 @@ class tuner_events():
                 # evend = self.mdydate(enddate, 0, 0, 0)
 
                 if evend < evstart:
-                    print("Ignoring %s absence entry: end(%s) is before start(%s)!" % (desc, evend, evstart))
+                    diag.warn("absence", "Ignoring %s absence entry: end(%s) is before start(%s)!", desc, evend, evstart)
                     continue
 
                 if evend < self.fromdate or evstart > self.todate:
@@ -169,24 +317,19 @@ class tuner_events():
                 # last day of a multi-day event.
                 evend += timedelta(days=1)
 
-                s_e = (evstart, evend)
-                self.events[s_e] = {}
-
-                self.events[s_e]['title'] = desc
-                self.events[s_e]['type'] = evtypes
                 # set venue to blank for listing
-                self.events[s_e]['venue'] = ""
+                yield (evstart, evend), {'title': desc, 'type': evtypes, 'venue': ""}
 
             return
 
-        for row in sh.iter_rows(min_row=2, values_only=True):
-            evtitl, venue, evdate, sttime, endtime, uni, evtype = list(row[:7])
+        for row in rows:
+            evtitl, venue, evdate, sttime, endtime, uni, evtype = decode(row)
 
             if evdate is None:
                 break # empty date column signals end of data
 
             if evtype != "absences" and venue not in self.venue_addrs:
-                print("didn't recognize %s as a valid venue???" % (venue))
+                diag.warn("venue", "didn't recognize %s as a valid venue???", venue)
                 continue
 
             if evtitl is None:
@@ -196,27 +339,71 @@ class tuner_events():
             evstart = self.sethm(evdate, sttime)
             evend = self.sethm(evdate, endtime)
 
-            overl = self.overlap(evstart, evend, evtitl)
-            if overl == 1:
-                continue
-
             if evend < self.fromdate or evstart > self.todate:
                 # event outside requested range - skip it.
                 continue
 
-            s_e = (evstart, evend)
-            if s_e in self.events:
-                timstr = evstart.strftime("%m/%d/%Y at %H:%M %p")
-                print("duplicate event start/end date/time: event1: %s, event2: %s, both on %s" % (self.events[s_e]['title'], evtitl, timstr))
-                continue
+            yield (evstart, evend), {'title': evtitl, 'venue': venue, 'uni': uni, 'type': evtype}
 
-            self.events[s_e] = {}
+    def dosheet(self, evtypes, yr):
+        # evtypes is "Performances" or "Rehearsals" or "board mtgs" or "absences"
 
-            self.events[s_e]['title'] = evtitl
-            self.events[s_e]['venue'] = venue
-            ## self.events[s_e]['evend'] = evend
-            self.events[s_e]['uni'] = uni
-            self.events[s_e]['type'] = evtype
+        for s_e, ev in self.sheet_rows(evtypes, yr):
+            if evtypes != "absences":
+                (evstart, evend) = s_e
+                overl = self.overlap(evstart, evend, ev['title'])
+                if overl == 1:
+                    continue
+
+                if s_e in self.events:
+                    diag.warn("duplicate", "duplicate event start/end date/time: event1: %s, event2: %s, both on %s",
+                        self.events[s_e]['title'], ev['title'], evstart.strftime("%m/%d/%Y at %H:%M %p"))
+                    continue
+
+            self.events[s_e] = ev
+
+    def stream(self):
+        ''' yield (s_e, event) for the events of the file, in order, without keeping them.
+            a workbook's sheets are read a row at a time; each sheet is expected to be
+            in date order, give or take REORDER. other files are loaded, then sorted.
+        '''
+
+        if self.infile is None or ".xls" not in self.infile:
+            if self.infile is not None and not self.events:
+                if self.infile.endswith(".evs"):
+                    self.snap_events()
+                else:
+                    self.ics_events()
+            for s_e in self.events.ordered():
+                yield s_e, self.events[s_e]
+            return
+
+        import warnings
+        warnings.filterwarnings("ignore", "Data Validation")
+
+        self.wb = load_workbook(self.infile, read_only=True)
+        sh = self.wb["venues"]
+        for row in sh.iter_rows(min_row=2, values_only=True):
+            ven, add1, add2 = list(row)[:3]
+            if ven is None:
+                break
+            self.venue_addrs[ven] = (add1, add2)
+
+        sheets = [("Performances", 'p'), ("Rehearsals", 'r'), ("board mtgs", 'b'), ("absences", 'a')]
+        last = None
+        for yr in range(self.fromdate.year, self.todate.year + 1):
+            rows = [in_order(self.sheet_rows(evtypes, yr), "%d %s" % (yr, evtypes))
+                for evtypes, t in sheets if self.dotypes[t]]
+            for s_e, ev in heapq.merge(*rows, key=itemgetter(0)):
+                if s_e == last:
+                    diag.warn("duplicate", "duplicate event start/end date/time: %s on %s", ev['title'],
+                        s_e[0].strftime("%m/%d/%Y at %H:%M %p"))
+                    continue
+                last = s_e
+                yield s_e, ev
+
+        self.wb.close()
+        self.wb = None
 
     def mdydate(self, d, h, m, s):
         # receive a datetime.datetime (excel date) from the absences spreadsheet,
@@ -227,10 +414,10 @@ class tuner_events():
             t = d.timetuple()
             dout = self.pst.localize(datetime(t.tm_year, t.tm_mon, t.tm_mday, h, m, s))
         except Exception as e:
-            print("%s: %s" % (e, str(d)))
+            diag.warn("date", "%s: %s", e, d)
             dout = None
 
-        print("mdydate returns %r for %s %d %d %d" % (dout, d, h, m, s))
+        diag.debug("date", "mdydate returns %r for %s %d %d %d", dout, d, h, m, s)
         return dout
 
     def dtdate(self, d):
@@ -241,7 +428,7 @@ class tuner_events():
         try:
             dout = self.pst.localize(datetime.strptime(sdate[:19], "%Y-%m-%d %H:%M:%S"))
         except Exception as e:
-            print("%s: %s" % (e, sdate))
+            diag.warn("date", "%s: %s", e, sdate)
             dout = None
 
         # print("dtdate returning {} for {}".format(dout, d))
@@ -261,7 +448,7 @@ class tuner_events():
     def list_events(self):
         print("\nListing events from %s" % (self.infile))
 
-        for s_e in sorted(self.events):
+        for s_e in self.events.ordered():
             (evst, evend) = s_e
             ev = self.events[s_e]
             if 'type' in ev:
@@ -294,6 +481,126 @@ class tuner_events():
                 print("  from %s to %s"  % (sts, ends))
                 print("  uni: %s, type: %s\n"  % (ev['uni'], typ))
 
+    def ics_start(self, mem, evstrt):
+        ''' turn an ics DTSTART (or RECURRENCE-ID) value into the datetime used in event keys '''
+
+        if not isinstance(evstrt, datetime):
+            # absences (and others?) s/b "all day", giving a "date", not "datetime"
+            evstrt = self.pst.localize(datetime(evstrt.year, evstrt.month, evstrt.day))
+        else:
+            evstrt = evstrt.astimezone(self.pst)
+            # it's a datetime - if we're loading an absences calendar, inputs from
+            # other than .ics have midnite today, as today 0:0:0
+            if "abs" in mem:
+                if evstrt.hour != 0:
+                    bump = evstrt.hour
+                    diag.debug("all day", "subtracting %d hours from %s", bump, evstrt)
+                    evstrt -= timedelta(hours=bump)
+
+        return evstrt
+
+    def ics_end(self, mem, evend):
+        ''' turn an ics DTEND value into the datetime used in event keys '''
+
+        if not isinstance(evend, datetime):
+            # better be a "date" if it's not a "datetime". turn it into a datetime
+            evend = self.pst.localize(datetime(evend.year, evend.month, evend.day))
+        else:
+            evend = evend.astimezone(self.pst)
+            # it's a datetime - if we're loading an absences calendar, inputs from
+            # other than .ics have midnite tonite, as tomorrow 0:0:0
+            if "abs" in mem:
+                if evend.hour != 0:
+                    bump = 24 - evend.hour
+                    diag.debug("all day", "adding %d hours to %s", bump, evend)
+                    evend += timedelta(hours=bump)
+
+        return evend
+
+    def ics_fields(self, sub):
+        ''' get the event fields from a VEVENT, noting its venue address '''
+
+        uni = ""
+        typ = ""
+
+        if 'DESCRIPTION' in sub:
+            descs = sub['DESCRIPTION'].split("\n")
+            for desc in descs:
+                if desc.startswith("UNIFORM:"):
+                    uni = desc[len("UNIFORM:"):]
+                elif desc.startswith("EVENT_TYPE:"):
+                    typ = desc[len("EVENT_TYPE:"):]
+
+        venue = ""
+        loc = ""
+        if 'LOCATION' in sub:
+            loc = sub['LOCATION']
+        if loc != "":
+            locflds = loc.split("\n")
+            venue = locflds.pop(0).strip()
+            if len(locflds) > 0:
+                loc = "\n".join(locflds)
+            else:
+                locflds = [""]
+            self.venue_addrs[venue] = locflds
+
+        return {'title': sub['SUMMARY'], 'venue': venue, 'addr': loc, 'uni': uni, 'type': typ, 'uid': sub['UID']}
+
+    def ics_kind(self, mem, fields, evstrt):
+        ''' an all day event with no type in an absences calendar was put in google by
+            hand - it's an absence, not a performance
+        '''
+
+        if not fields['type'] and "abs" in mem and evstrt.hour == 0 and evstrt.minute == 0:
+            fields['type'] = "absences"
+
+    def absence_end(self, fields, evend):
+        ''' an all day absence ends as a workbook one does (see sheet_rows) - at 23:59:59
+            a day after its last day, not at midnight after it - so the two compare the same
+        '''
+
+        if fields['type'] == "absences" and (evend.hour, evend.minute, evend.second) == (0, 0, 0):
+            return self.pst.localize(datetime(evend.year, evend.month, evend.day, 23, 59, 59))
+        return evend
+
+    def ics_add(self, evstrt, evend, fields):
+        ''' add one event (or one instance of a recurring event). returns 1 if added, else 0 '''
+
+        s_e = (evstrt, evend)
+        typ = fields['type']
+
+        if s_e in self.events and self.events[s_e].get('cal') != fields.get('cal'):
+            # another calendar has an event at this time - dedupe decides
+            self.clashes.append((s_e, dict(fields)))
+            return 0
+
+        if s_e in self.events:
+            diag.warn("conflict", "conflict:\n  start, end times: %s, %s\n  name 1: %s\n  name 2: %s",
+                evstrt.strftime("%Y-%m-%d %H:%M"), evend.strftime("%Y-%m-%d %H:%M"), self.events[s_e]['title'],
+                fields['title'])
+            return 0
+
+        if not self.wanted(typ):
+            return 0
+
+        self.events[s_e] = dict(fields)
+        return 1
+
+    def wanted(self, typ):
+        ''' whether an event of type typ, from an .ics or a snapshot, is one of dotypes.
+            events of a type not known here are always wanted.
+        '''
+
+        if typ == "Rehearsal":
+            return self.dotypes['r']
+        elif typ in ["Performance", "Other", "Social Event"]:
+            return self.dotypes['p']
+        elif typ == "Meeting":
+            return self.dotypes['b']
+        elif typ == "absences":
+            return self.dotypes['a']
+        return True
+
     def do_cal(self, mem, caldata):
         ''' add events from ics calendar to list of events '''
 
@@ -301,103 +608,169 @@ class tuner_events():
         gcal = cal.from_ical(caldata)
         nev = 0
 
+        # a changed instance of a recurring event is its own VEVENT, with the UID of
+        # the series and a RECURRENCE-ID giving the instance it replaces.
+        overridden = set()
+        for sub in gcal.subcomponents:
+            if sub.name == "VEVENT" and 'RECURRENCE-ID' in sub:
+                overridden.add((str(sub['UID']), self.ics_start(mem, sub['RECURRENCE-ID'].dt)))
+
         for sub in gcal.subcomponents:
             if sub.name == "VEVENT":
                 uid = sub['UID']
                 # print("uid from ics %s" % (uid))
 
-                evstrt = sub['DTSTART'].from_ical(sub['DTSTART'])
-                if not isinstance(evstrt, datetime):
-                    # absences (and others?) s/b "all day", giving a "date", not "datetime"
-                    evstrt = self.pst.localize(datetime(evstrt.year, evstrt.month, evstrt.day))
-                else:
-                    evstrt = evstrt.astimezone(self.pst)
-                    # it's a datetime - if we're loading an absences calendar, inputs from
-                    # other than .ics have midnite today, as today 0:0:0
-                    if "abs" in mem:
-                        if evstrt.hour != 0:
-                            bump = evstrt.hour
-                            print("subtracting {} hours from {}".format(bump, evstrt))
-                            evstrt -= timedelta(hours=bump)
-
-                evend = sub['DTEND'].from_ical(sub['DTEND'])
-                if not isinstance(evend, datetime):
-                    # better be a "date" if it's not a "datetime". turn it into a datetime
-                    evend = self.pst.localize(datetime(evend.year, evend.month, evend.day))
-                else:
-                    evend = evend.astimezone(self.pst)
-                    # it's a datetime - if we're loading an absences calendar, inputs from
-                    # other than .ics have midnite tonite, as tomorrow 0:0:0
-                    if "abs" in mem:
-                        if evend.hour != 0:
-                            bump = 24 - evend.hour
-                            print("adding {} hours to {}".format(bump, evend))
-                            evend += timedelta(hours=bump)
+                if 'RRULE' in sub or 'RDATE' in sub:
+                    # recurring - expand just the instances in range
+                    fields = None
+                    for dtstrt, dtend in occurrences(sub, self.fromdate, self.todate):
+                        evstrt = self.ics_start(mem, dtstrt)
+                        evend = self.ics_end(mem, dtend)
+                        if (str(uid), evstrt) in overridden:
+                            continue
+                        if evend < self.fromdate or evstrt > self.todate:
+                            continue
+                        if fields is None:
+                            fields = self.ics_fields(sub)
+                            fields['cal'] = mem
+                            self.ics_kind(mem, fields, evstrt)
+                        fields['recurid'] = evstrt
+                        nev += self.ics_add(evstrt, self.absence_end(fields, evend), fields)
+                    continue
+
+                evstrt = self.ics_start(mem, sub['DTSTART'].dt)
+                evend = self.ics_end(mem, sub['DTEND'].dt)
 
                 if evend < self.fromdate or evstrt > self.todate:
                     # event outside requested range - skip it.
                     continue
 
-                uni = ""
-                typ = ""
-
-                if 'DESCRIPTION' in sub:
-                    descs = sub['DESCRIPTION'].split("\n")
-                    for desc in descs:
-                        if desc.startswith("UNIFORM:"):
-                            uni = desc[len("UNIFORM:"):]
-                        elif desc.startswith("EVENT_TYPE:"):
-                            typ = desc[len("EVENT_TYPE:"):]
-
-                venue = ""
-                loc = ""
-                if 'LOCATION' in sub:
-                    loc = sub['LOCATION']
-                if loc != "":
-                    locflds = loc.split("\n")
-                    venue = locflds.pop(0).strip()
-                    if len(locflds) > 0:
-                        loc = "\n".join(locflds)
-                    else:
-                        locflds = [""]
-                    self.venue_addrs[venue] = locflds
-
-                title = sub['SUMMARY']
-
-                s_e = (evstrt, evend)
+                if 'RECURRENCE-ID' in sub and sub.get('STATUS') == 'CANCELLED':
+                    # an instance removed from its series
+                    continue
 
-                if s_e in self.events:
-                    print("conflict:")
-                    print("  start, end times: %s, %s" % (evstrt.strftime("%Y-%m-%d %H:%M"),
-                        evend.strftime("%Y-%m-%d %H:%M")))
-                    print("  name 1: %s" % (self.events[s_e]['title']))
-                    print("  name 2: %s" % (title))
-                    
-                else:
-                    if typ == "Rehearsal" and not self.dotypes['r']:
-                        continue
-                    elif typ in ["Performance", "Other", "Social Event"] and not self.dotypes['p']:
-                        continue
-                    elif typ == "Meeting" and not self.dotypes['b']:
-                        continue
+                fields = self.ics_fields(sub)
+                fields['cal'] = mem
+                self.ics_kind(mem, fields, evstrt)
+                if 'RECURRENCE-ID' in sub:
+                    fields['recurid'] = self.ics_start(mem, sub['RECURRENCE-ID'].dt)
 
-                    self.events[s_e] = {'title': title, 'venue': venue, 'addr': loc, 'uni': uni, 'type': typ, 'uid': uid}
-                    nev += 1
+                nev += self.ics_add(evstrt, self.absence_end(fields, evend), fields)
 
         self.calfiles[mem][1] = nev
 
+    def collisions(self):
+        ''' digests of the VEVENTs left out by the prefilter that start on a day with
+            events that were read - they could have been at the same time as one of them
+        '''
+
+        days = set(s_e[0].strftime("%Y%m%d") for s_e in self.events)
+        days.update(s_e[0].strftime("%Y%m%d") for s_e, ev in getattr(self, 'clashes', []))
+        return set(digest for digest, day in self.skipped.items() if day is None or day in days)
+
+    def dedupe(self):
+        ''' find the events that are in more than one of the calendars loaded, and keep
+            just one of each. the pairs found are in self.duplicates.
+        '''
+
+        dups, conflicts = find_duplicates(self.events, self.clashes, list(self.calfiles))
+
+        for keep, drop, why in dups:
+            (ks_e, kev), (ds_e, dev) = keep, drop
+            if self.events.get(ds_e) is dev:
+                del self.events[ds_e]
+                self.calfiles[dev['cal']][1] -= 1
+            if self.events.get(ks_e) is not kev:
+                # the one kept was left out when it clashed
+                self.events[ks_e] = kev
+                self.calfiles[kev['cal']][1] += 1
+
+            diag.warn("duplicate", "duplicate (%s): %s at %s in %s and %s at %s in %s - keeping the %s one", why,
+                kev['title'], ks_e[0].strftime("%m/%d/%Y %H:%M"), kev['cal'], dev['title'],
+                ds_e[0].strftime("%m/%d/%Y %H:%M"), dev['cal'], kev['cal'])
+
+        for s_e, ev in conflicts:
+            (evstrt, evend) = s_e
+            diag.warn("conflict", "conflict:\n  start, end times: %s, %s\n  name 1: %s\n  name 2: %s",
+                evstrt.strftime("%Y-%m-%d %H:%M"), evend.strftime("%Y-%m-%d %H:%M"), self.events[s_e]['title'],
+                ev['title'])
+
+        self.duplicates = dups
+        self.clashes = []
+
+    def snap_events(self):
+        ''' load events in date range from a snapshot written by save_snapshot '''
+
+        snap = snapshot(self.infile)
+
+        if int(self.fromdate.timestamp()) < snap.fromts or int(self.todate.timestamp()) > snap.tots:
+            diag.warn("snapshot", "WARNING: snapshot %s only covers %s to %s", self.infile,
+                datetime.fromtimestamp(snap.fromts, self.pst).strftime("%b %d, %Y"),
+                datetime.fromtimestamp(snap.tots, self.pst).strftime("%b %d, %Y"))
+
+        self.event_source = snap.source
+        self.venue_addrs = snap.venue_addrs()
+        self.calfiles = snap.calfiles()
+
+        for s_e, ev in snap.events(self.pst, self.fromdate, self.todate):
+            if self.wanted(ev.get('type')):
+                self.events[s_e] = ev
+
+        snap.close()
+
+    def save_snapshot(self, ofn=None):
+        ''' save events, venue_addrs and calfiles to a snapshot; default name is infile with .evs '''
+
+        if ofn is None:
+            ofn = os.path.splitext(self.infile)[0] + ".evs"
+
+        nev = write_snapshot(self, ofn)
+        print("Saved {} events to snapshot {}".format(nev, ofn))
+        return ofn
+
+    def subset(self, dotypes, fromdate, todate):
+        ''' a copy with just the events of dotypes from fromdate through todate, as if
+            the file had been loaded with those options. the events are copied too, so
+            whatever uses the subset can't change them for another.
+        '''
+
+        sub = copy(self)
+        sub.dotypes = dotypes
+        sub.fromdate = fromdate.astimezone(self.pst)
+        sub.todate = todate.astimezone(self.pst)
+        sub.event_class = sub
+
+        sub.events = event_map()
+        for s_e in self.events.range(sub.fromdate, sub.todate):
+            ev = self.events[s_e]
+            if not dotypes[event_kind(ev)]:
+                continue
+            sub.events[s_e] = dict(ev)
+
+        if hasattr(self, 'calfiles'):
+            sub.calfiles = dict((cal, list(cf)) for cal, cf in self.calfiles.items())
+            if self.infile in sub.calfiles:
+                sub.calfiles[self.infile][1] = len(sub.events)
+
+        return sub
+
     def ics_events(self):
         ''' process an ical-type file, create a list of events '''
 
         self.calfiles = {}
         oldcal = None
 
-        self.events = {}
+        self.events = event_map()
+        self.clashes = []
+        self.duplicates = []
 
         if self.infile.endswith(".ics"):
             fo = open(self.infile, "r")
             oldcal = fo.read()
             fo.close()
+            if self.skip:
+                oldcal, cut = drop_blocks(oldcal, self.infile, self.skip)
+                self.skipped.update(cut)
 
             self.calfiles[self.infile] = [self.infile, 0]
             self.do_cal(self.infile, oldcal)
@@ -405,29 +778,27 @@ class tuner_events():
         elif self.infile.endswith(".zip"):
             fz = ZipFile(self.infile)
 
-            yrs = sorted([int(self.fromdate.year), int(self.todate.year) + 1])
             knowncals = fz.namelist()
 
             if not self.calnames:
-                self.calnames = []
-                for yr in range(yrs[0], yrs[1]):
-                    self.calnames.append("tuners{}_".format(yr))
-                    if self.dotypes['a']:
-                        self.calnames.append("tunersboardabs{}_".format(yr))
+                self.calnames = zip_calnames(self.fromdate, self.todate, self.dotypes)
 
+            found = members(knowncals, self.calnames)
             for caln in self.calnames:
-                found = False
-                for mem in knowncals:
-                    if mem.startswith(caln):
-                        self.calfiles[caln] = [mem, 0]
-                        found = True
-                        break
-                if not found:
-                    print("no such calendar: {}".format(caln))
+                if caln in found:
+                    self.calfiles[caln] = [found[caln], 0]
+                else:
+                    diag.warn("calendar", "no such calendar: %s", caln)
 
             for calname in self.calfiles:
                 mem = self.calfiles[calname][0]
                 oldcal = fz.read(mem)
+                if self.skip:
+                    oldcal, cut = drop_blocks(oldcal.decode('utf-8'), mem, self.skip)
+                    self.skipped.update(cut)
                 self.do_cal(calname, oldcal)
 
             fz.close()
+
+            if len(self.calfiles) > 1:
+                self.dedupe()
@@ -0,0 +1,403 @@
+#!/usr/bin/env python
+'''
+    write calendar changes back into a copy of the excel workbook.
+
+    each change goes to the "<year> <type>" sheet for its event. new events are
+    added after the last row of data, changed events get the new title, venue and
+    uniform, and cancelled events lose their title (date but no title => not booked),
+    or their description for absences. venues the workbook doesn't know are added
+    to the "venues" sheet.
+
+    only the xml of the sheets with changes is read and rewritten - the other parts
+    of the workbook are copied as they are, so formatting, data validation and
+    named ranges all survive. rows are never inserted or deleted, so nothing that
+    refers to a row needs to be renumbered.
+'''
+
+import os
+import re
+import pytz
+from datetime import datetime, timedelta
+from zipfile import ZipFile
+import xml.etree.ElementTree as ET
+from openpyxl.utils.cell import coordinate_from_string, column_index_from_string, get_column_letter
+from openpyxl.utils.datetime import from_excel, to_excel, CALENDAR_WINDOWS_1900, CALENDAR_MAC_1904
+
+import diag
+from tuner_events import event_kind, column_positions, EVENT_COLUMNS, ABSENCE_COLUMNS
+
+MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+RELS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PKGRELS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+# sheet name (after the year) for each kind of event
+SHEETS = {'p': "Performances", 'r': "Rehearsals", 'b': "board mtgs", 'a': "absences"}
+
+def qn(tag):
+    return "{%s}%s" % (MAIN, tag)
+
+def sheet_for(s_e, ev):
+    return "%d %s" % (s_e[0].year, SHEETS[event_kind(ev)])
+
+def read_part(zf, part):
+    ''' parse one xml part of the workbook. returns (root, namespaces) - the namespace
+        declarations are needed to write it back the way it was.
+    '''
+
+    nss = []
+    with zf.open(part) as fo:
+        for event, item in ET.iterparse(fo, events=['start-ns']):
+            nss.append(item)
+    for prefix, uri in nss:
+        ET.register_namespace(prefix, uri)
+    with zf.open(part) as fo:
+        root = ET.parse(fo).getroot()
+    return root, nss
+
+def write_part(root, nss):
+    ''' serialize a part, declaring every namespace the original declared. (ElementTree
+        drops unused ones, but mc:Ignorable may still name them.)
+    '''
+
+    xml = ET.tostring(root, encoding="UTF-8", xml_declaration=True).decode('utf-8')
+    m = re.search(r"<[^?!][^>]*>", xml)
+    head = m.group(0)
+    extra = ""
+    for prefix, uri in nss:
+        decl = 'xmlns:%s="' % prefix if prefix else 'xmlns="'
+        if decl not in head:
+            extra += ' %s%s"' % (decl, uri)
+    if extra:
+        close = len(head) - (2 if head.endswith("/>") else 1)
+        xml = xml[:m.start()] + head[:close] + extra + head[close:] + xml[m.end():]
+    return xml.encode('utf-8')
+
+def sheet_parts(zf):
+    ''' ({sheet name: zip member}, date epoch of the workbook) '''
+
+    wb, _ = read_part(zf, "xl/workbook.xml")
+    rels, _ = read_part(zf, "xl/_rels/workbook.xml.rels")
+    targets = {}
+    for rel in rels.iter("{%s}Relationship" % PKGRELS):
+        target = rel.get('Target')
+        targets[rel.get('Id')] = target.lstrip("/") if target.startswith("/") else "xl/" + target
+
+    epoch = CALENDAR_WINDOWS_1900
+    pr = wb.find(qn('workbookPr'))
+    if pr is not None and pr.get('date1904') in ['1', 'true']:
+        epoch = CALENDAR_MAC_1904
+
+    parts = {}
+    for sh in wb.iter(qn('sheet')):
+        parts[sh.get('name')] = targets[sh.get("{%s}id" % RELS)]
+    return parts, epoch
+
+def shared_strings(zf):
+    ''' the workbook's shared strings, by index '''
+
+    if "xl/sharedStrings.xml" not in zf.namelist():
+        return []
+    root, _ = read_part(zf, "xl/sharedStrings.xml")
+    return ["".join(t.text or "" for t in si.iter(qn('t'))) for si in root.findall(qn('si'))]
+
+class sheet_rows():
+    ''' the rows of one sheet's xml, by row number '''
+
+    def __init__(self, root):
+        self.root = root
+        self.data = root.find(qn('sheetData'))
+        self.rows = dict((int(row.get('r')), row) for row in self.data.findall(qn('row')))
+        self.maxrow = max(self.rows) if self.rows else 0
+        self.maxcol = 1
+
+    def cell(self, r, col, create=False):
+        row = self.rows.get(r)
+        if row is None:
+            if not create:
+                return None
+            row = ET.Element(qn('row'), r=str(r))
+            later = [n for n in self.rows if n > r]
+            if later:
+                self.data.insert(list(self.data).index(self.rows[min(later)]), row)
+            else:
+                self.data.append(row)
+            self.rows[r] = row
+            self.maxrow = max(self.maxrow, r)
+
+        after = None
+        for n, c in enumerate(row.findall(qn('c'))):
+            if c.get('r') is None:
+                # cells without a reference are in order, from column 1
+                ccol = n + 1
+            else:
+                ccol = column_index_from_string(coordinate_from_string(c.get('r'))[0])
+            if ccol == col:
+                return c
+            if ccol > col:
+                after = c
+                break
+
+        if not create:
+            return None
+        c = ET.Element(qn('c'), r="%s%d" % (get_column_letter(col), r))
+        if after is None:
+            row.append(c)
+        else:
+            row.insert(list(row).index(after), c)
+        self.maxcol = max(self.maxcol, col)
+        return c
+
+    def number(self, r, col):
+        ''' numeric value of a cell, or None '''
+
+        c = self.cell(r, col)
+        if c is None or c.get('t') not in [None, 'n']:
+            return None
+        v = c.find(qn('v'))
+        if v is None or v.text is None:
+            return None
+        return float(v.text)
+
+    def header(self, strings):
+        ''' the values of the first row - the column headings. strings are the
+            workbook's shared strings.
+        '''
+
+        hdrs = []
+        row = self.rows.get(1)
+        for n, c in enumerate(row.findall(qn('c')) if row is not None else []):
+            col = column_index_from_string(coordinate_from_string(c.get('r'))[0]) if c.get('r') else n + 1
+            hdrs += [None] * (col - len(hdrs))
+            v = c.find(qn('v'))
+            if c.get('t') == 'inlineStr':
+                hdrs[col - 1] = "".join(t.text or "" for t in c.iter(qn('t')))
+            elif v is None or v.text is None:
+                continue
+            elif c.get('t') == 's':
+                hdrs[col - 1] = strings[int(v.text)]
+            else:
+                hdrs[col - 1] = v.text
+        return hdrs
+
+    def empty(self, r, col):
+        c = self.cell(r, col)
+        if c is None:
+            return True
+        return c.find(qn('v')) is None and c.find(qn('is')) is None
+
+    def set(self, r, col, val, style=None, restyle=False):
+        ''' set a cell to val - None, a string, or a number. style is used if the cell
+            has none of its own, or with restyle, in place of its own.
+        '''
+
+        c = self.cell(r, col, create=True)
+        for child in list(c):
+            c.remove(child)
+        if style is not None and (restyle or c.get('s') is None):
+            c.set('s', style)
+
+        if val is None:
+            c.attrib.pop('t', None)
+        elif isinstance(val, str):
+            c.set('t', 'inlineStr')
+            t = ET.SubElement(ET.SubElement(c, qn('is')), qn('t'))
+            t.text = val
+            if val != val.strip():
+                t.set("{http://www.w3.org/XML/1998/namespace}space", "preserve")
+        else:
+            c.attrib.pop('t', None)
+            ET.SubElement(c, qn('v')).text = repr(val)
+
+    def styles(self, r):
+        ''' {column: style} of the cells in row r, to format a new row like it '''
+
+        st = {}
+        row = self.rows.get(r)
+        if row is not None:
+            for c in row.findall(qn('c')):
+                if c.get('r') and c.get('s'):
+                    st[column_index_from_string(coordinate_from_string(c.get('r'))[0])] = c.get('s')
+        return st
+
+    def fix_dimension(self):
+        ''' stretch the used range to take in rows added to the sheet '''
+
+        dim = self.root.find(qn('dimension'))
+        if dim is None:
+            return
+        ref = dim.get('ref').split(":")
+        lastcol, lastrow = coordinate_from_string(ref[-1])
+        col = max(column_index_from_string(lastcol), self.maxcol)
+        row = max(lastrow, self.maxrow)
+        dim.set('ref', "%s:%s%d" % (ref[0], get_column_letter(col), row))
+
+def sheet_columns(rows, strings, absences):
+    ''' {field: column (1 based)} of a sheet, found from its headings the way
+        tuner_events finds them to read it
+    '''
+
+    where = column_positions(rows.header(strings), ABSENCE_COLUMNS if absences else EVENT_COLUMNS)
+    cols = dict((fld, n + 1) for fld, n in where.items())
+    if absences and 'desc' in cols:
+        cols['title'] = cols.pop('desc')
+    return cols
+
+def row_key(rows, r, cols, absences, tz, epoch):
+    ''' the s_e row r is loaded as (see tuner_events.dosheet), or None past the end of data '''
+
+    if absences:
+        st = rows.number(r, cols['start']) if 'start' in cols else None
+        if st is None:
+            return None
+        end = rows.number(r, cols['end']) if 'end' in cols else None
+        if end is None:
+            end = st
+        stdate = from_excel(int(st), epoch)
+        enddate = from_excel(int(end), epoch)
+        evstart = tz.localize(datetime(stdate.year, stdate.month, stdate.day))
+        evend = tz.localize(datetime(enddate.year, enddate.month, enddate.day, 23, 59, 59))
+        return (evstart, evend + timedelta(days=1))
+
+    day = rows.number(r, cols['date']) if 'date' in cols else None
+    if day is None:
+        return None
+    evdate = from_excel(int(day), epoch)
+    evdate = tz.localize(datetime(evdate.year, evdate.month, evdate.day))
+
+    def at(col):
+        t = rows.number(r, cols[col]) if col in cols else None
+        if not t:
+            return evdate
+        mins = int(round((t % 1) * 24 * 60))
+        return evdate.replace(hour=mins // 60, minute=mins % 60)
+
+    return (at('start'), at('end'))
+
+def patch_sheet(rows, changes, absences, tz, epoch, strings):
+    ''' apply changes ({s_e: event}) to the rows of one sheet. returns the number applied. '''
+
+    cols = sheet_columns(rows, strings, absences)
+    napplied = 0
+
+    def put(r, fld, val, style=None, restyle=False):
+        # a column the sheet doesn't have is left out
+        if fld in cols:
+            rows.set(r, cols[fld], val, style, restyle)
+
+    # change the rows of events which are already there
+    style = {}
+    r = 2
+    while True:
+        key = row_key(rows, r, cols, absences, tz, epoch)
+        if key is None:
+            break
+        # new rows are formatted like the ones above them
+        style.update(rows.styles(r))
+        ev = changes.get(key)
+        st = ev.get('status') if ev is not None else None
+        if st == 'CANCELLED':
+            put(r, 'title', None)
+            napplied += 1
+        elif st == 'MODIFIED':
+            put(r, 'title', ev.get('title'))
+            if not absences:
+                put(r, 'venue', ev.get('venue') or None)
+                put(r, 'uni', ev.get('uni') or None)
+            napplied += 1
+        r += 1
+
+    # new events go after the last row of data
+    for s_e in sorted(s_e for s_e, ev in changes.items() if 'status' not in ev):
+        ev = changes[s_e]
+        (evstrt, evend) = s_e
+        day = datetime(evstrt.year, evstrt.month, evstrt.day)
+        if absences:
+            last = evend - timedelta(days=1)
+            vals = {'start': day, 'end': datetime(last.year, last.month, last.day), 'title': ev.get('title')}
+        else:
+            vals = {'title': ev.get('title'), 'venue': ev.get('venue') or None, 'date': day,
+                'start': evstrt.time().replace(tzinfo=None), 'end': evend.time().replace(tzinfo=None),
+                'uni': ev.get('uni') or None, 'type': ev.get('type') or None}
+
+        for fld, col in cols.items():
+            val = vals[fld]
+            if val is not None and not isinstance(val, str):
+                val = to_excel(val, epoch)
+            # a blank row may be formatted already, but a date or time is only one
+            # with the data rows' format - as a plain number it doesn't read back
+            put(r, fld, val, style.get(col), restyle=fld in ('date', 'start', 'end'))
+        napplied += 1
+        r += 1
+
+    rows.fix_dimension()
+    return napplied
+
+def patch_venues(rows, vens, venue_addrs):
+    ''' add venues after the last known one (the first row with no name) '''
+
+    r = 2
+    while not rows.empty(r, 1):
+        r += 1
+
+    style = rows.styles(r - 1)
+    for ven in vens:
+        addr = list(venue_addrs.get(ven) or []) + ["", ""]
+        for col, val in enumerate([ven, addr[0] or None, addr[1] or None], 1):
+            rows.set(r, col, val, style.get(col))
+        diag.info("venue", "added venue %s", ven)
+        r += 1
+
+    rows.fix_dimension()
+
+def update_workbook(infile, ofn, events, venue_addrs, known_venues):
+    ''' write a copy of workbook infile to ofn with the changes in events
+        ({s_e: event}, as from event_changes) applied. venue_addrs has the
+        addresses of venues which may be new to the workbook, known_venues
+        are the ones it has already.
+        returns the number of changes written.
+    '''
+
+    tz = pytz.timezone("US/Pacific")
+
+    bysheet = {}
+    for s_e, ev in events.items():
+        bysheet.setdefault(sheet_for(s_e, ev), {})[s_e] = ev
+
+    vens = sorted(set(ev['venue'] for ev in events.values() if ev.get('venue')
+        and ev.get('status') != 'CANCELLED' and ev['venue'] not in known_venues))
+
+    patched = {}
+    nchg = 0
+    with ZipFile(infile) as zf:
+        parts, epoch = sheet_parts(zf)
+        strings = shared_strings(zf)
+
+        for name in sorted(bysheet):
+            if name not in parts:
+                changes = bysheet[name]
+                diag.warn("sheet", "no sheet %s for %d changes:%s", name, len(changes),
+                    "".join("\n  %s on %s" % (ev.get('title'), evstrt.strftime("%b %d, %Y at %I:%M%p"))
+                        for (evstrt, evend), ev in sorted(changes.items())))
+                continue
+
+            root, nss = read_part(zf, parts[name])
+            nchg += patch_sheet(sheet_rows(root), bysheet[name], name.endswith(" absences"), tz, epoch, strings)
+            patched[parts[name]] = write_part(root, nss)
+
+        if vens and "venues" in parts:
+            root, nss = read_part(zf, parts["venues"])
+            patch_venues(sheet_rows(root), vens, venue_addrs)
+            patched[parts["venues"]] = write_part(root, nss)
+
+        # written beside ofn, then put in its place - ofn may be infile, still being read
+        tmpfn = os.path.join(os.path.dirname(os.path.abspath(ofn)), ".%s.tmp" % (os.path.basename(ofn)))
+        try:
+            with ZipFile(tmpfn, "w") as out:
+                for info in zf.infolist():
+                    out.writestr(info, patched.get(info.filename) or zf.read(info.filename))
+        except BaseException:
+            os.remove(tmpfn)
+            raise
+
+    os.replace(tmpfn, ofn)
+    return nchg